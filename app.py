@@ -1,42 +1,219 @@
-from flask import Flask, render_template_string, request, redirect, url_for, send_from_directory, session, jsonify
+from flask import Flask, Request, Response, render_template, request, redirect, url_for, send_file, send_from_directory, session, jsonify
 import psycopg2
 import psycopg2.extras
 import os
+import hashlib
+import time
+from datetime import timezone
 import requests
-from werkzeug.utils import secure_filename
+from common.pg_pool import ConnectionPool, PoolTimeout, TimedConnection
+from common.templating import register_templates
+from common.assets import register_assets
+from common.compression import init_compression
+from common.metrics import CallbackGauge, init_metrics
+from common.tracing import init_tracing
+from common.deadlines import bounded_timeout, check_deadline, init_deadlines
+from common.http_client import ServiceClient, passthrough_headers, stream_response
+from catalog import CatalogCache, InvalidCursor, SORTS, DEFAULT_SORT, MAX_PAGE_SIZE
+from page_cache import RenderedPageCache, make_etag
+from cover_mirror import CoverMirror, is_external
+from covers import (CoverStore, CoverUpload, UnsupportedImage, VariantCache, VARIANT_FORMATS, VARIANT_WIDTHS,
+                    cover_summary, index_legacy_covers, render_variant)
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.secret_key = 'your-secret-key-here'  # Required for sessions
+init_metrics(app)
+init_tracing(app, 'store')
+init_deadlines(app)
+compressor = init_compression(app)
 
 # Configuration
 CART_SERVICE_URL = os.environ.get('CART_SERVICE_URL', 'http://localhost:5002')
 ORDER_SERVICE_URL = os.environ.get('ORDER_SERVICE_URL', 'http://localhost:5001')
 USERS_SERVICE_URL = os.environ.get('USERS_SERVICE_URL', 'http://localhost:5003')
 
+# Orders fetched per order-service round-trip when building the admin panel
+ADMIN_ORDERS_PAGE_SIZE = int(os.environ.get('ADMIN_ORDERS_PAGE_SIZE', '500'))
+
+# Shared keep-alive HTTP clients for the downstream services
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '20'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '2'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+cart_client = ServiceClient('cart', CART_SERVICE_URL,
+                            timeout=float(os.environ.get('CART_SERVICE_TIMEOUT', '10')),
+                            connect_timeout=HTTP_CONNECT_TIMEOUT, pool_size=HTTP_POOL_SIZE,
+                            max_retries=HTTP_MAX_RETRIES)
+order_client = ServiceClient('order', ORDER_SERVICE_URL,
+                             timeout=float(os.environ.get('ORDER_SERVICE_TIMEOUT', '5')),
+                             connect_timeout=HTTP_CONNECT_TIMEOUT, pool_size=HTTP_POOL_SIZE,
+                             max_retries=HTTP_MAX_RETRIES)
+users_client = ServiceClient('users', USERS_SERVICE_URL,
+                             timeout=float(os.environ.get('USERS_SERVICE_TIMEOUT', '5')),
+                             connect_timeout=HTTP_CONNECT_TIMEOUT, pool_size=HTTP_POOL_SIZE,
+                             max_retries=HTTP_MAX_RETRIES)
+
 # Database configuration
 DB_HOST = os.environ.get('DB_HOST', 'localhost')
 DB_PORT = os.environ.get('DB_PORT', '5432')
 DB_NAME = os.environ.get('DB_NAME', 'music_store')
 DB_USER = os.environ.get('DB_USER', 'music_user')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'music_password')
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'covers')
-
-def get_db_connection():
-    """Get database connection"""
+UPLOAD_FOLDER = os.environ.get('COVER_STORE_DIR', os.path.join(os.path.dirname(__file__), 'static', 'covers'))
+# Covers that predate the content-addressed store, indexed by `flask index-covers`
+LEGACY_COVER_DIRS = [os.path.join(os.path.dirname(__file__), 'album-covers'), UPLOAD_FOLDER]
+# Cover URLs never change their content, so browsers may cache them for a year
+COVER_MAX_AGE = 365 * 24 * 60 * 60
+# Requests with a larger body (e.g. cover uploads) are rejected with 413 before being read
+COVER_MAX_UPLOAD_MB = int(os.environ.get('COVER_MAX_UPLOAD_MB', '16'))
+# Resized covers (/covers/<name>?w=&fmt=) are cached on disk up to this size
+COVER_VARIANT_DIR = os.environ.get('COVER_VARIANT_DIR', os.path.join(UPLOAD_FOLDER, 'variants'))
+COVER_VARIANT_CACHE_MB = int(os.environ.get('COVER_VARIANT_CACHE_MB', '256'))
+# Cover URLs on other hosts are copied into the cover store in the background
+COVER_MIRROR_ENABLED = os.environ.get('COVER_MIRROR_ENABLED', 'true').lower() == 'true'
+COVER_MIRROR_TIMEOUT = float(os.environ.get('COVER_MIRROR_TIMEOUT', '10'))
+COVER_MIRROR_MAX_ATTEMPTS = int(os.environ.get('COVER_MIRROR_MAX_ATTEMPTS', '5'))
+
+# Connection pool configuration
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '5'))
+DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800'))
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', '300'))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+
+def _connect():
     return psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
         database=DB_NAME,
         user=DB_USER,
-        password=DB_PASSWORD
+        password=DB_PASSWORD,
+        connection_factory=TimedConnection
     )
 
+db_pool = ConnectionPool(
+    _connect,
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    max_idle=DB_POOL_MAX_IDLE,
+    check_interval=DB_POOL_CHECK_INTERVAL
+)
+
+def _pool_gauge():
+    stats = db_pool.stats()
+    return {(state,): stats[state] for state in ('in_use', 'idle')}
+
+CallbackGauge('db_pool_connections', 'Open database connections by state', ('state',), _pool_gauge)
+
+def get_db_connection():
+    """Check out a pooled database connection (returned to the pool when the with-block exits)"""
+    check_deadline('querying the database')
+    return db_pool.connection(timeout=bounded_timeout(DB_POOL_TIMEOUT))
+
+# Columns and indexes added after the first release of init.sql; applied to existing databases at startup
+SCHEMA_MIGRATIONS = [
+    'ALTER TABLE albums ADD COLUMN IF NOT EXISTS cover_color VARCHAR(7)',
+    'ALTER TABLE albums ADD COLUMN IF NOT EXISTS cover_placeholder TEXT',
+    # Keyset pagination on (sort column, id) for the storefront and /api/albums
+    'CREATE INDEX IF NOT EXISTS idx_albums_created_at_id ON albums (created_at, id)',
+    'CREATE INDEX IF NOT EXISTS idx_albums_price_id ON albums (price, id)',
+    'CREATE INDEX IF NOT EXISTS idx_albums_name_id ON albums (name, id)',
+    # Catalog version lookups (COUNT(*), MAX(updated_at)) used by the catalog cache
+    'CREATE INDEX IF NOT EXISTS idx_albums_updated_at ON albums (updated_at)',
+]
+SCHEMA_RETRY_SECONDS = 5
+schema_migrated = False
+schema_retry_at = 0.0
+
+def migrate_schema():
+    """Bring an existing database up to the current schema; returns False if the database is unreachable"""
+    global schema_migrated, schema_retry_at
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                for statement in SCHEMA_MIGRATIONS:
+                    cur.execute(statement)
+    except (psycopg2.OperationalError, PoolTimeout) as e:
+        print(f"Schema migration postponed, database unavailable: {e}")
+        schema_retry_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+        return False
+    schema_migrated = True
+    return True
+
+migrate_schema()
+
+@app.before_request
+def ensure_schema():
+    # The database was down at startup; keep trying until it is reachable
+    if not schema_migrated and time.monotonic() >= schema_retry_at:
+        migrate_schema()
+
+# Album catalog served from memory; revalidated against the database version at most this often
+CATALOG_REVALIDATE_SECONDS = float(os.environ.get('CATALOG_REVALIDATE_SECONDS', '5'))
+catalog = CatalogCache(get_db_connection, revalidate_interval=CATALOG_REVALIDATE_SECONDS)
+STOREFRONT_PAGE_SIZE = int(os.environ.get('STOREFRONT_PAGE_SIZE', '24'))
+# Cards likely to be above the fold; covers further down the page are lazy-loaded
+EAGER_COVERS = 8
+
+# Rendered storefront pages, identical for every visitor until the catalog changes
+storefront_cache = RenderedPageCache(max_entries=int(os.environ.get('STOREFRONT_CACHE_SIZE', '128')))
+
+def album_to_json(album):
+    """Serialize an album row for the JSON APIs"""
+    return {
+        'id': album['id'],
+        'name': album['name'],
+        'artist': album['artist'],
+        'price': float(album['price']),
+        'cover_url': album['cover_url'],
+        'cover_color': album['cover_color']
+    }
+
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif'}
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
 # Ensure upload folder exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = COVER_MAX_UPLOAD_MB * 1024 * 1024
+cover_store = CoverStore(UPLOAD_FOLDER)
+
+class CoverUploadRequest(Request):
+    """Request whose uploaded files stream straight into the cover store's temporary directory.
+
+    Werkzeug would otherwise buffer each file in a SpooledTemporaryFile and
+    the cover store would copy it again; here the hash and image type are
+    computed while the multipart body is parsed.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return CoverUpload(cover_store)
+
+app.request_class = CoverUploadRequest
+cover_variants = VariantCache(COVER_VARIANT_DIR, COVER_VARIANT_CACHE_MB * 1024 * 1024)
+
+def cover_store_url(cover_name):
+    """Public URL of a content-addressed cover"""
+    return f'/covers/{cover_name}'
+
+def summarize_cover(cover_name):
+    """(dominant color, placeholder) for a stored cover, or (None, None) if it cannot be decoded"""
+    try:
+        return cover_summary(cover_store.path_for(cover_name))
+    except (OSError, ValueError) as e:
+        print(f"Error summarizing cover {cover_name}: {e}")
+        return None, None
+
+def repoint_mirrored_cover(album_id, url, cover_name):
+    """Switch an album from its external cover URL to the mirrored copy"""
+    cover_color, cover_placeholder = summarize_cover(cover_name)
+    catalog.update_cover(album_id, url, cover_store_url(cover_name), cover_color, cover_placeholder)
+
+cover_mirror = CoverMirror(cover_store, repoint_mirrored_cover,
+                           timeout=(HTTP_CONNECT_TIMEOUT, COVER_MIRROR_TIMEOUT),
+                           max_attempts=COVER_MIRROR_MAX_ATTEMPTS)
 
 @app.route('/test-static')
 def test_static():
@@ -72,6 +249,26 @@ def debug_db():
     except Exception as e:
         return f'<h1>Database Error</h1><p>Error: {str(e)}</p>'
 
+@app.route('/debug-covers/variants')
+def debug_cover_variants():
+    """Resized cover cache statistics"""
+    return jsonify(cover_variants.stats())
+
+@app.route('/debug-covers/mirror')
+def debug_cover_mirror():
+    """External cover mirroring statistics"""
+    return jsonify(cover_mirror.stats())
+
+@app.route('/debug-services')
+def debug_services():
+    """Timeouts and circuit breaker state of each downstream service"""
+    return jsonify({client.name: client.stats() for client in (cart_client, order_client, users_client)})
+
+@app.route('/debug-db/pool')
+def debug_db_pool():
+    """Connection pool statistics"""
+    return jsonify(db_pool.stats())
+
 # Main HTML Template
 INDEX_HTML = '''
 <!DOCTYPE html>
@@ -80,513 +277,8 @@ INDEX_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Metal Music Store - Brutal Collection</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-        }
-
-        .header-content {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-
-        .logo {
-            font-size: 1.8rem;
-            font-weight: 800;
-            text-decoration: none;
-            color: white;
-            letter-spacing: -0.5px;
-        }
-
-        .nav-actions {
-            display: flex;
-            gap: 20px;
-            align-items: center;
-        }
-
-        .cart-link {
-            background: rgba(255,255,255,0.2);
-            color: white;
-            padding: 12px 24px;
-            border-radius: 8px;
-            text-decoration: none;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            backdrop-filter: blur(10px);
-        }
-
-        .cart-link:hover {
-            background: rgba(255,255,255,0.3);
-            transform: translateY(-1px);
-        }
-
-        .admin-button {
-            background: rgba(255,255,255,0.1);
-            color: white;
-            border: 1px solid rgba(255,255,255,0.3);
-            padding: 12px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            text-decoration: none;
-        }
-
-        .admin-button:hover {
-            background: rgba(255,255,255,0.2);
-            transform: translateY(-1px);
-        }
-
-        /* Hero Section */
-        .hero {
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-            padding: 80px 0;
-            text-align: center;
-            margin-bottom: 60px;
-        }
-
-        .hero h1 {
-            font-size: 3.5rem;
-            font-weight: 800;
-            margin-bottom: 20px;
-            color: #1a1a1a;
-            letter-spacing: -1px;
-        }
-
-        .hero p {
-            font-size: 1.3rem;
-            color: #666;
-            max-width: 600px;
-            margin: 0 auto;
-            font-weight: 400;
-        }
-
-        /* Main Content */
-        .main-content {
-            padding: 40px 0;
-        }
-
-        .section-header {
-            text-align: center;
-            margin-bottom: 60px;
-        }
-
-        .section-title {
-            font-size: 2.5rem;
-            font-weight: 700;
-            color: #1a1a1a;
-            margin-bottom: 16px;
-            letter-spacing: -0.5px;
-        }
-
-        .section-subtitle {
-            font-size: 1.1rem;
-            color: #666;
-            max-width: 600px;
-            margin: 0 auto;
-        }
-
-        /* Album Grid */
-        .album-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(280px, 1fr));
-            gap: 30px;
-            margin-bottom: 80px;
-        }
-
-        .album-card {
-            background: white;
-            border-radius: 16px;
-            overflow: hidden;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            transition: all 0.3s ease;
-            position: relative;
-        }
-
-        .album-card:hover {
-            transform: translateY(-8px);
-            box-shadow: 0 20px 40px rgba(0,0,0,0.12);
-        }
-
-        .album-cover-container {
-            position: relative;
-            overflow: hidden;
-            aspect-ratio: 1;
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-        }
-
-        .album-cover {
-            width: 100%;
-            height: 100%;
-            object-fit: cover;
-            transition: transform 0.3s ease;
-        }
-
-        .album-card:hover .album-cover {
-            transform: scale(1.05);
-        }
-
-        .album-cover-placeholder {
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            height: 100%;
-            color: #999;
-            font-size: 0.9rem;
-            font-weight: 500;
-            text-align: center;
-            padding: 20px;
-        }
-
-        .album-info {
-            padding: 24px;
-        }
-
-        .album-title {
-            font-size: 1.2rem;
-            font-weight: 700;
-            color: #1a1a1a;
-            margin-bottom: 8px;
-            line-height: 1.3;
-        }
-
-        .album-artist {
-            font-size: 1rem;
-            color: #666;
-            margin-bottom: 16px;
-            font-weight: 500;
-        }
-
-        .album-price {
-            font-size: 1.4rem;
-            font-weight: 800;
-            color: #667eea;
-            margin-bottom: 20px;
-        }
-
-        .album-actions {
-            display: flex;
-            gap: 12px;
-            align-items: center;
-        }
-
-        .quantity-input {
-            width: 80px;
-            padding: 12px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            font-size: 1rem;
-            font-weight: 500;
-            text-align: center;
-            transition: border-color 0.3s ease;
-        }
-
-        .quantity-input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-
-        .add-to-cart-btn {
-            flex: 1;
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 14px 20px;
-            border-radius: 8px;
-            font-size: 1rem;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-        }
-
-        .add-to-cart-btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        /* Empty State */
-        .empty-state {
-            text-align: center;
-            padding: 80px 20px;
-            color: #666;
-        }
-
-        .empty-state h3 {
-            font-size: 1.5rem;
-            margin-bottom: 16px;
-            color: #1a1a1a;
-        }
-
-        .empty-state p {
-            font-size: 1.1rem;
-            max-width: 500px;
-            margin: 0 auto;
-        }
-
-        /* Login Modal */
-        .login-modal {
-            display: none;
-            position: fixed;
-            z-index: 1000;
-            left: 0;
-            top: 0;
-            width: 100%;
-            height: 100%;
-            background-color: rgba(0,0,0,0.5);
-            backdrop-filter: blur(5px);
-        }
-
-        .login-content {
-            background: white;
-            margin: 10% auto;
-            padding: 40px;
-            border-radius: 16px;
-            width: 90%;
-            max-width: 400px;
-            box-shadow: 0 20px 60px rgba(0,0,0,0.2);
-        }
-
-        .login-header {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-
-        .login-title {
-            font-size: 1.8rem;
-            font-weight: 700;
-            color: #1a1a1a;
-            margin-bottom: 8px;
-        }
-
-        .login-subtitle {
-            color: #666;
-            font-size: 1rem;
-        }
-
-        .close {
-            position: absolute;
-            top: 20px;
-            right: 20px;
-            font-size: 24px;
-            font-weight: bold;
-            color: #999;
-            cursor: pointer;
-            transition: color 0.3s ease;
-        }
-
-        .close:hover {
-            color: #1a1a1a;
-        }
-
-        .login-form {
-            display: flex;
-            flex-direction: column;
-            gap: 20px;
-        }
-
-        .form-group {
-            display: flex;
-            flex-direction: column;
-            gap: 8px;
-        }
-
-        .form-group label {
-            font-weight: 600;
-            color: #1a1a1a;
-            font-size: 0.9rem;
-        }
-
-        .form-group input {
-            padding: 14px 16px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease;
-        }
-
-        .form-group input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-
-        .login-btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 16px;
-            border-radius: 8px;
-            font-size: 1rem;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            margin-top: 10px;
-        }
-
-        .login-btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .error-message {
-            color: #e74c3c;
-            text-align: center;
-            margin: 10px 0;
-            display: none;
-            font-size: 0.9rem;
-        }
-
-        /* Cart Notification */
-        .cart-notification {
-            position: fixed;
-            top: 20px;
-            right: 20px;
-            background: white;
-            border-radius: 12px;
-            padding: 24px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.15);
-            z-index: 1000;
-            transform: translateX(400px);
-            transition: transform 0.3s ease;
-            max-width: 320px;
-            border: 1px solid #e1e5e9;
-        }
-
-        .cart-notification.show {
-            transform: translateX(0);
-        }
-
-        .cart-notification h3 {
-            color: #1a1a1a;
-            margin-bottom: 12px;
-            font-size: 1.2rem;
-            font-weight: 700;
-        }
-
-        .cart-notification p {
-            color: #666;
-            margin-bottom: 20px;
-            line-height: 1.5;
-        }
-
-        .cart-notification .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 12px 20px;
-            border-radius: 8px;
-            font-size: 0.9rem;
-            font-weight: 600;
-            cursor: pointer;
-            transition: all 0.3s ease;
-            text-decoration: none;
-            display: inline-block;
-            margin-right: 10px;
-        }
-
-        .cart-notification .btn:hover {
-            transform: translateY(-1px);
-            box-shadow: 0 5px 15px rgba(102, 126, 234, 0.3);
-        }
-
-        .cart-notification .btn-secondary {
-            background: #f8f9fa;
-            color: #666;
-            border: 1px solid #e1e5e9;
-        }
-
-        .cart-notification .btn-secondary:hover {
-            background: #e9ecef;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-        }
-
-        /* Responsive Design */
-        @media (max-width: 768px) {
-            .container {
-                padding: 0 16px;
-            }
-
-            .hero {
-                padding: 60px 0;
-            }
-
-            .hero h1 {
-                font-size: 2.5rem;
-            }
-
-            .hero p {
-                font-size: 1.1rem;
-            }
-
-            .section-title {
-                font-size: 2rem;
-            }
-
-            .album-grid {
-                grid-template-columns: repeat(auto-fill, minmax(250px, 1fr));
-                gap: 20px;
-            }
-
-            .header-content {
-                flex-direction: column;
-                gap: 20px;
-            }
-
-            .nav-actions {
-                width: 100%;
-                justify-content: center;
-            }
-        }
-
-        @media (max-width: 480px) {
-            .album-grid {
-                grid-template-columns: 1fr;
-            }
-
-            .hero h1 {
-                font-size: 2rem;
-            }
-
-            .album-actions {
-                flex-direction: column;
-                gap: 16px;
-            }
-
-            .quantity-input {
-                width: 100%;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/index.css') }}">
 </head>
 <body>
     <!-- Header -->
@@ -616,15 +308,29 @@ INDEX_HTML = '''
             <div class="section-header">
                 <h2 class="section-title">📀 Available Albums</h2>
                 <p class="section-subtitle">Browse our collection of brutal metal albums</p>
+                <form method="get" action="/" class="sort-form">
+                    <label for="sort">Sort by</label>
+                    <select id="sort" name="sort" class="sort-select" onchange="this.form.submit()">
+                        {% for value, label in sorts %}
+                        <option value="{{value}}" {% if value == sort %}selected{% endif %}>{{label}}</option>
+                        {% endfor %}
+                    </select>
+                </form>
             </div>
 
             {% if albums %}
             <div class="album-grid">
                 {% for a in albums %}
                 <div class="album-card">
-                    <div class="album-cover-container">
-                        {% if a.cover_url %}
-                        <img src="{{a.cover_url}}" alt="{{a.name}} cover" class="album-cover" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
+                    <div class="album-cover-container"{% if a.cover_color %} style="background: {{a.cover_color}}{% if a.cover_placeholder %} url({{a.cover_placeholder}}) center / cover no-repeat{% endif %};"{% endif %}>
+                        {% if a.cover_url and a.cover_url.startswith('/covers/') %}
+                        <picture>
+                            <source type="image/webp" sizes="(max-width: 480px) 100vw, 280px" srcset="{{a.cover_url}}?w=280&amp;fmt=webp 280w, {{a.cover_url}}?w=560&amp;fmt=webp 560w, {{a.cover_url}}?w=1120&amp;fmt=webp 1120w">
+                            <img src="{{a.cover_url}}?w=280&amp;fmt=jpeg"{% if loop.index > EAGER_COVERS %} loading="lazy"{% endif %} decoding="async" sizes="(max-width: 480px) 100vw, 280px" srcset="{{a.cover_url}}?w=280&amp;fmt=jpeg 280w, {{a.cover_url}}?w=560&amp;fmt=jpeg 560w" alt="{{a.name}} cover" class="album-cover" onerror="this.style.display='none'; this.parentElement.nextElementSibling.style.display='flex';">
+                        </picture>
+                        <div class="album-cover-placeholder" style="display: none;">{{a.name}}</div>
+                        {% elif a.cover_url %}
+                        <img src="{{a.cover_url}}"{% if loop.index > EAGER_COVERS %} loading="lazy"{% endif %} alt="{{a.name}} cover" class="album-cover" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
                         <div class="album-cover-placeholder" style="display: none;">{{a.name}}</div>
                         {% else %}
                         <div class="album-cover-placeholder">{{a.name}}</div>
@@ -647,6 +353,14 @@ INDEX_HTML = '''
                 </div>
                 {% endfor %}
             </div>
+            <nav class="pagination">
+                {% if cursor %}
+                <a href="{{ url_for('index', sort=sort) }}" class="page-link">&larr; First page</a>
+                {% endif %}
+                {% if next_cursor %}
+                <a href="{{ url_for('index', sort=sort, cursor=next_cursor) }}" class="page-link">More albums &rarr;</a>
+                {% endif %}
+            </nav>
             {% else %}
             <div class="empty-state">
                 <h3>No albums available</h3>
@@ -679,149 +393,7 @@ INDEX_HTML = '''
         </div>
     </div>
 
-    <script>
-        function showTab(tabName) {
-            // Hide all content sections
-            const contentSections = document.querySelectorAll('.content-section');
-            contentSections.forEach(section => {
-                section.classList.remove('active');
-            });
-            
-            // Remove active class from all tabs
-            const tabs = document.querySelectorAll('.tab');
-            tabs.forEach(tab => {
-                tab.classList.remove('active');
-            });
-            
-            // Show selected content section
-            document.getElementById(tabName).classList.add('active');
-            
-            // Add active class to clicked tab
-            event.target.classList.add('active');
-        }
-
-        function showLoginModal() {
-            document.getElementById('loginModal').style.display = 'block';
-            document.getElementById('username').focus();
-        }
-
-        function closeLoginModal() {
-            document.getElementById('loginModal').style.display = 'none';
-            document.getElementById('loginError').style.display = 'none';
-            document.getElementById('username').value = '';
-            document.getElementById('password').value = '';
-        }
-
-        function handleLogin(event) {
-            event.preventDefault();
-            
-            const username = document.getElementById('username').value;
-            const password = document.getElementById('password').value;
-            const errorDiv = document.getElementById('loginError');
-            
-            // Call login API
-            fetch('/api/login', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    username: username,
-                    password: password
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    // Store token in localStorage
-                    localStorage.setItem('adminToken', data.token);
-                    localStorage.setItem('adminUser', JSON.stringify(data.user));
-                    
-                    // Close modal and redirect to admin page
-                    closeLoginModal();
-                    window.location.href = '/admin';
-                } else {
-                    errorDiv.textContent = data.error || 'Login failed';
-                    errorDiv.style.display = 'block';
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                errorDiv.textContent = 'Login failed. Please try again.';
-                errorDiv.style.display = 'block';
-            });
-            
-            return false;
-        }
-
-        // Close modal when clicking outside of it
-        window.onclick = function(event) {
-            const modal = document.getElementById('loginModal');
-            if (event.target == modal) {
-                closeLoginModal();
-            }
-        }
-
-        function addToCart(event, form) {
-            event.preventDefault();
-            
-            const formData = new FormData(form);
-            
-            fetch('/add_to_cart', {
-                method: 'POST',
-                body: formData
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    showCartNotification(data.redirect_url);
-                } else {
-                    alert('Error adding to cart: ' + data.error);
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                alert('Error adding to cart');
-            });
-            
-            return false;
-        }
-
-        function showCartNotification(redirectUrl) {
-            // Remove existing notification
-            const existing = document.querySelector('.cart-notification');
-            if (existing) {
-                existing.remove();
-            }
-            
-            // Create notification
-            const notification = document.createElement('div');
-            notification.className = 'cart-notification';
-            notification.innerHTML = `
-                <h3>🤘 Item Added!</h3>
-                <p>Your brutal metal album has been added to the cart!</p>
-                <a href="/cart" class="btn">View Cart</a>
-                <button class="btn btn-secondary" onclick="this.parentElement.remove()">Continue Shopping</button>
-            `;
-            
-            document.body.appendChild(notification);
-            
-            // Show notification
-            setTimeout(() => {
-                notification.classList.add('show');
-            }, 100);
-            
-            // Auto-hide after 8 seconds
-            setTimeout(() => {
-                notification.classList.remove('show');
-                setTimeout(() => {
-                    if (notification.parentElement) {
-                        notification.remove();
-                    }
-                }, 300);
-            }, 8000);
-        }
-    </script>
+    <script src="{{ asset_url('js/index.js') }}"></script>
 </body>
 </html>
 '''
@@ -834,230 +406,8 @@ ADMIN_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Store Administration - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-        }
-
-        .header-content {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .header p {
-            font-size: 1.1rem;
-            opacity: 0.9;
-            font-weight: 500;
-        }
-
-        .admin-info {
-            background: rgba(255,255,255,0.1);
-            color: white;
-            padding: 10px 20px;
-            border-radius: 8px;
-            border: 1px solid rgba(255,255,255,0.3);
-            font-size: 0.9rem;
-            font-weight: 600;
-        }
-
-        .back-button {
-            background: rgba(255,255,255,0.1);
-            color: white;
-            border: 1px solid rgba(255,255,255,0.3);
-            padding: 12px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            text-decoration: none;
-        }
-
-        .back-button:hover {
-            background: rgba(255,255,255,0.2);
-            transform: translateY(-1px);
-        }
-
-        .section-title {
-            color: #1a1a1a;
-            margin-bottom: 25px;
-            font-size: 2.5rem;
-            font-weight: 700;
-            letter-spacing: -0.5px;
-            position: relative;
-        }
-
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-
-        .stat-card {
-            background: white;
-            color: #1a1a1a;
-            padding: 25px;
-            border-radius: 12px;
-            text-align: center;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .stat-number {
-            font-size: 3rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #667eea;
-        }
-
-        .stat-label {
-            font-size: 1.1rem;
-            color: #666;
-            font-weight: 600;
-        }
-
-        .form-grid {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 30px;
-        }
-
-        .form-group {
-            margin-bottom: 20px;
-        }
-
-        .form-group label {
-            display: block;
-            color: #1a1a1a;
-            font-weight: 600;
-            margin-bottom: 8px;
-            font-size: 0.9rem;
-        }
-
-        .form-group input {
-            width: 100%;
-            padding: 14px 16px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease;
-            background: white;
-            color: #1a1a1a;
-        }
-
-        .form-group input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 14px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .btn-danger {
-            background: linear-gradient(135deg, #e74c3c 0%, #c0392b 100%);
-            border-color: #c0392b;
-        }
-
-        .btn-danger:hover {
-            background: linear-gradient(135deg, #c0392b 0%, #e74c3c 100%);
-            box-shadow: 0 8px 25px rgba(231, 76, 60, 0.3);
-        }
-
-        .orders-list {
-            list-style: none;
-            max-height: 300px;
-            overflow-y: auto;
-        }
-
-        .order-item {
-            background: white;
-            padding: 15px;
-            border-radius: 8px;
-            margin-bottom: 10px;
-            border-left: 4px solid #667eea;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-        }
-
-        .empty-state {
-            text-align: center;
-            padding: 40px 20px;
-            color: #666;
-        }
-
-        .empty-state p {
-            font-size: 1.1rem;
-            margin-bottom: 10px;
-        }
-
-        @media (max-width: 768px) {
-            .form-grid {
-                grid-template-columns: 1fr;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .container {
-                padding: 0 16px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/admin.css') }}">
 </head>
 <body>
     <div class="container">
@@ -1183,117 +533,64 @@ ADMIN_HTML = '''
         </div>
     </div>
 
-    <script>
-        // Initialize admin user info
-        function initAdminInfo() {
-            const adminUser = localStorage.getItem('adminUser');
-            if (adminUser) {
-                try {
-                    const user = JSON.parse(adminUser);
-                    document.getElementById('adminUsername').textContent = user.username || 'Admin';
-                } catch (e) {
-                    console.error('Error parsing admin user:', e);
-                }
-            }
-        }
-
-        // Check if user is still authenticated
-        function checkAuth() {
-            const token = localStorage.getItem('adminToken');
-            if (!token) {
-                window.location.href = '/';
-                return;
-            }
-
-            fetch('/api/verify', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ token: token })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (!data.valid || data.user.role !== 'admin') {
-                    localStorage.removeItem('adminToken');
-                    localStorage.removeItem('adminUser');
-                    window.location.href = '/';
-                }
-            })
-            .catch(error => {
-                console.error('Auth check failed:', error);
-                // Don't redirect immediately on network errors, just log
-                console.log('Network error during auth check, continuing...');
-            });
-        }
-
-        // Logout function
-        function logout() {
-            const token = localStorage.getItem('adminToken');
-            
-            // Call logout API
-            fetch('/admin/logout', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({ token: token })
-            })
-            .then(response => response.json())
-            .then(data => {
-                // Clear local storage
-                localStorage.removeItem('adminToken');
-                localStorage.removeItem('adminUser');
-                // Redirect to home page
-                window.location.href = '/';
-            })
-            .catch(error => {
-                console.error('Logout error:', error);
-                // Clear local storage anyway and redirect
-                localStorage.removeItem('adminToken');
-                localStorage.removeItem('adminUser');
-                window.location.href = '/';
-            });
-        }
-
-        // Check auth every 10 minutes (less frequent to avoid constant redirects)
-        setInterval(checkAuth, 600000);
-        
-        // Initialize on page load
-        initAdminInfo();
-        checkAuth();
-        updateTimestamp();
-        
-        // Auto-refresh statistics every 30 seconds
-        setInterval(refreshStats, 30000);
-        
-        function refreshStats() {
-            // Refresh the page to get updated statistics
-            window.location.reload();
-        }
-        
-        function updateTimestamp() {
-            const now = new Date();
-            const timeString = now.toLocaleTimeString();
-            document.getElementById('updateTime').textContent = timeString;
-        }
-    </script>
+    <script src="{{ asset_url('js/admin.js') }}"></script>
 </body>
 </html>
 '''
 
+# Compile the templates once at startup
+TEMPLATES = register_templates(app, 'store', {
+    'index.html': INDEX_HTML,
+    'admin.html': ADMIN_HTML
+})
+# Content-hashed CSS/JS bundles, served at /assets/store/
+ASSETS = register_assets(app, 'store', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+# Changes whenever the storefront markup or its assets do, so redeploys invalidate cached pages and ETags
+INDEX_TEMPLATE_FINGERPRINT = hashlib.sha256(
+    (INDEX_HTML + ''.join(sorted(ASSETS.values()))).encode()).hexdigest()[:12]
+
+# Storefront sort options in display order
+SORT_LABELS = [
+    ('newest', 'Newest first'),
+    ('oldest', 'Oldest first'),
+    ('price_asc', 'Price: low to high'),
+    ('price_desc', 'Price: high to low'),
+    ('name', 'Name'),
+]
+
 # --- Routes ---
 @app.route('/')
 def index():
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute('SELECT * FROM albums ORDER BY created_at DESC')
-            albums = cur.fetchall()
-            cur.execute('''SELECT orders.id, albums.name, albums.artist, orders.quantity, albums.price 
-                          FROM orders JOIN albums ON orders.album_id = albums.id 
-                          ORDER BY orders.created_at DESC''')
-            orders = cur.fetchall()
-    return render_template_string(INDEX_HTML, albums=albums, orders=orders)
+    sort = request.args.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    cursor = request.args.get('cursor') or None
+    
+    count, last_updated = catalog.version
+    etag = make_etag(count, last_updated, INDEX_TEMPLATE_FINGERPRINT, sort, cursor, STOREFRONT_PAGE_SIZE)
+    # Only the ETag is used for revalidation: MAX(updated_at) does not move when an
+    # album is deleted, so Last-Modified alone cannot tell that the page changed
+    # Weak comparison: compressed responses carry the same ETag marked weak
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        def render():
+            albums, next_cursor = catalog.page(sort, cursor, STOREFRONT_PAGE_SIZE)
+            return render_template(TEMPLATES['index.html'], albums=albums, sort=sort, cursor=cursor,
+                                   next_cursor=next_cursor, sorts=SORT_LABELS, EAGER_COVERS=EAGER_COVERS)
+        try:
+            body = storefront_cache.get_or_render(etag, render)
+        except InvalidCursor:
+            return redirect(url_for('index', sort=sort))
+        response = Response(body, mimetype='text/html')
+    
+    response.set_etag(etag)
+    if last_updated is not None:
+        response.last_modified = last_updated.replace(tzinfo=timezone.utc)
+    # Shared caches may store the page but must revalidate it on every use
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/add', methods=['POST'])
 def add_album():
@@ -1303,66 +600,95 @@ def add_album():
     cover_url = request.form.get('cover_url', '').strip()
     cover_file = request.files.get('cover_file')
     cover_path = ''
+    cover_color = cover_placeholder = None
     if cover_file and cover_file.filename != '' and allowed_file(cover_file.filename):
-        filename = secure_filename(cover_file.filename)
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        # Ensure unique filename
-        base, ext = os.path.splitext(filename)
-        i = 1
-        while os.path.exists(save_path):
-            filename = f"{base}_{i}{ext}"
-            save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            i += 1
-        cover_file.save(save_path)
-        cover_path = url_for('static', filename=f'covers/{filename}')
+        # Stored under its content hash; identical uploads share one file
+        try:
+            cover_name = cover_store.put_upload(cover_file.stream)
+        except UnsupportedImage as e:
+            return str(e), 400
+        cover_path = cover_store_url(cover_name)
+        cover_color, cover_placeholder = summarize_cover(cover_name)
     elif cover_url:
         cover_path = cover_url
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('INSERT INTO albums (name, artist, price, cover_url) VALUES (%s, %s, %s, %s)', 
-                       (name, artist, price, cover_path))
-        conn.commit()
+    album = catalog.add_album(name, artist, price, cover_path, cover_color, cover_placeholder)
+    if COVER_MIRROR_ENABLED and is_external(cover_path):
+        cover_mirror.submit(album['id'], cover_path)
     return redirect(url_for('index'))
 
+@app.route('/covers/<name>')
+def serve_cover(name):
+    """Serve a content-addressed cover with far-future immutable caching.
+
+    ``?w=<width>&fmt=webp|jpeg`` serves a scaled-down copy from the variant cache.
+    """
+    path = cover_store.path_for(name)
+    if path is None or not os.path.exists(path):
+        return 'Cover not found', 404
+    width = request.args.get('w', type=int)
+    fmt = request.args.get('fmt', 'jpeg')
+    if width is None and 'fmt' not in request.args:
+        response = send_from_directory(os.path.dirname(path), name, max_age=COVER_MAX_AGE)
+    else:
+        if width not in VARIANT_WIDTHS or fmt not in VARIANT_FORMATS:
+            return f"Unsupported variant, w must be one of {list(VARIANT_WIDTHS)} and fmt one of {list(VARIANT_FORMATS)}", 400
+        key = f"{name.split('.')[0]}-{width}.{fmt}"
+        try:
+            variant_path = cover_variants.get(key, lambda dest: render_variant(path, width, fmt, dest))
+        except OSError as e:
+            print(f"Error resizing cover {name}: {e}")
+            return 'Cover could not be resized', 422
+        response = send_file(variant_path, mimetype=f'image/{fmt}', max_age=COVER_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/delete/<int:album_id>', methods=['POST'])
 def delete_album(album_id):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute('DELETE FROM albums WHERE id = %s', (album_id,))
-        conn.commit()
+    catalog.delete_album(album_id)
     return redirect(url_for('index'))
 
 @app.route('/api/album/<int:album_id>')
 def get_album(album_id):
     """API endpoint to get album details"""
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute('SELECT * FROM albums WHERE id = %s', (album_id,))
-            album = cur.fetchone()
+    album = catalog.get(album_id)
     
     if not album:
         return jsonify({'error': 'Album not found'}), 404
     
+    return jsonify(album_to_json(album)), 200
+
+@app.route('/api/albums')
+def list_albums():
+    """API endpoint to page through the catalog (?limit=&cursor=&sort=)"""
+    sort = request.args.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        return jsonify({'error': f'Unknown sort. Use one of: {", ".join(SORTS)}'}), 400
+    try:
+        limit = int(request.args.get('limit', STOREFRONT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+    try:
+        albums, next_cursor = catalog.page(sort, request.args.get('cursor') or None, limit)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
     return jsonify({
-        'id': album['id'],
-        'name': album['name'],
-        'artist': album['artist'],
-        'price': float(album['price']),
-        'cover_url': album['cover_url']
+        'albums': [album_to_json(album) for album in albums],
+        'sort': sort,
+        'limit': limit,
+        'next_cursor': next_cursor
     }), 200
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
     """Forward request to cart service with album details"""
-    import requests
-    
     try:
         # Get album details first
         album_id = request.form['album_id']
-        with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute('SELECT * FROM albums WHERE id = %s', (album_id,))
-                album = cur.fetchone()
+        album = catalog.get(album_id)
         
         if not album:
             return jsonify({'error': 'Album not found'}), 404
@@ -1383,7 +709,7 @@ def add_to_cart():
         }
         
         # Forward the request to cart service with album details
-        response = requests.post(f"{CART_SERVICE_URL}/add_to_cart", data=cart_data)
+        response = cart_client.post('/add_to_cart', data=cart_data)
         
         if response.status_code == 200:
             # Parse JSON response
@@ -1408,8 +734,6 @@ def add_to_cart():
 @app.route('/cart')
 def view_cart():
     """Forward request to cart service"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1419,16 +743,24 @@ def view_cart():
             session_id = session['cart_session_id']
         
         # Pass session_id as query parameter
-        response = requests.get(f"{CART_SERVICE_URL}/?session_id={session_id}")
-        return response.content, response.status_code
+        response = cart_client.get('/', params={'session_id': session_id},
+                                   headers=passthrough_headers(request), stream=True)
+        return stream_response(response)
+    except requests.RequestException as e:
+        return f"Error connecting to cart service: {str(e)}", 503
+
+@app.route('/assets/cart/<path:filename>')
+def cart_assets(filename):
+    """Forward requests for the cart pages' assets to cart service"""
+    try:
+        response = cart_client.get(f'/assets/cart/{filename}', headers=passthrough_headers(request), stream=True)
+        return stream_response(response)
     except requests.RequestException as e:
         return f"Error connecting to cart service: {str(e)}", 503
 
 @app.route('/checkout')
 def checkout():
     """Forward request to cart service checkout"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1436,16 +768,15 @@ def checkout():
             return redirect(url_for('view_cart'))
         
         # Pass session_id as query parameter
-        response = requests.get(f"{CART_SERVICE_URL}/checkout?session_id={session_id}")
-        return response.content, response.status_code
+        response = cart_client.get('/checkout', params={'session_id': session_id},
+                                   headers=passthrough_headers(request), stream=True)
+        return stream_response(response)
     except requests.RequestException as e:
         return f"Error connecting to cart service: {str(e)}", 503
 
 @app.route('/process_payment', methods=['POST'])
 def process_payment():
     """Forward payment processing to cart service"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1456,12 +787,15 @@ def process_payment():
         form_data = request.form.copy()
         form_data['session_id'] = session_id
         
-        response = requests.post(f"{CART_SERVICE_URL}/process_payment", data=form_data, allow_redirects=False)
+        response = cart_client.post('/process_payment', data=form_data, allow_redirects=False)
         
         # Handle redirects from cart service
         if response.status_code in [301, 302, 303, 307, 308]:
             redirect_url = response.headers.get('Location', '')
-            if redirect_url.startswith('/'):
+            if redirect_url.startswith('/payment/'):
+                # The payment is being processed in the background; its status page has the outcome
+                return redirect(redirect_url, code=303)
+            elif redirect_url.startswith('/'):
                 # If it's a relative URL, redirect to our order_success route
                 return redirect(url_for('order_success'))
             else:
@@ -1475,8 +809,6 @@ def process_payment():
 @app.route('/remove_item', methods=['POST'])
 def remove_item():
     """Forward remove item request to cart service"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1488,7 +820,7 @@ def remove_item():
             'item_id': request.form['item_id'],
             'session_id': session_id
         }
-        response = requests.post(f"{CART_SERVICE_URL}/remove_item", data=cart_data)
+        response = cart_client.post('/remove_item', data=cart_data)
         return response.content, response.status_code
     except requests.RequestException as e:
         return f"Error connecting to cart service: {str(e)}", 503
@@ -1496,8 +828,6 @@ def remove_item():
 @app.route('/update_quantity', methods=['POST'])
 def update_quantity():
     """Forward update quantity request to cart service"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1510,7 +840,7 @@ def update_quantity():
             'quantity': request.form['quantity'],
             'session_id': session_id
         }
-        response = requests.post(f"{CART_SERVICE_URL}/update_quantity", data=cart_data)
+        response = cart_client.post('/update_quantity', data=cart_data)
         return response.content, response.status_code
     except requests.RequestException as e:
         return f"Error connecting to cart service: {str(e)}", 503
@@ -1518,8 +848,6 @@ def update_quantity():
 @app.route('/order_success')
 def order_success():
     """Forward order success to cart service"""
-    import requests
-    
     try:
         # Get session_id from our session
         session_id = session.get('cart_session_id')
@@ -1527,18 +855,45 @@ def order_success():
             return redirect(url_for('index'))
         
         # Pass session_id as query parameter
-        response = requests.get(f"{CART_SERVICE_URL}/order_success?session_id={session_id}")
-        return response.content, response.status_code
+        response = cart_client.get('/order_success', params={'session_id': session_id},
+                                   headers=passthrough_headers(request), stream=True)
+        return stream_response(response)
+    except requests.RequestException as e:
+        return f"Error connecting to cart service: {str(e)}", 503
+
+@app.route('/payment/<payment_id>')
+def payment_status(payment_id):
+    """Forward the payment status page to cart service"""
+    try:
+        session_id = session.get('cart_session_id')
+        if not session_id:
+            return redirect(url_for('index'))
+        
+        # The cart service redirects to order_success once the payment has succeeded
+        response = cart_client.get(f'/payment/{payment_id}', params={'session_id': session_id},
+                                   headers=passthrough_headers(request), stream=True, allow_redirects=False)
+        return stream_response(response)
     except requests.RequestException as e:
         return f"Error connecting to cart service: {str(e)}", 503
 
+@app.route('/api/payments/<payment_id>')
+def payment_status_api(payment_id):
+    """Forward payment status polling to cart service"""
+    try:
+        session_id = session.get('cart_session_id')
+        if not session_id:
+            return jsonify({'error': 'Payment not found'}), 404
+        response = cart_client.get(f'/api/payments/{payment_id}', params={'session_id': session_id})
+        return response.content, response.status_code, {'Content-Type': 'application/json',
+                                                        'Cache-Control': 'no-store'}
+    except requests.RequestException as e:
+        return jsonify({'error': f'Cart service unavailable: {str(e)}'}), 503
+
 @app.route('/api/login', methods=['POST'])
 def login():
     """Forward login request to users service"""
-    import requests
-    
     try:
-        response = requests.post(f"{USERS_SERVICE_URL}/api/login", json=request.get_json())
+        response = users_client.post('/api/login', json=request.get_json())
         return response.content, response.status_code
     except requests.RequestException as e:
         return jsonify({'error': f'Users service unavailable: {str(e)}'}), 503
@@ -1546,10 +901,8 @@ def login():
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """Forward logout request to users service"""
-    import requests
-    
     try:
-        response = requests.post(f"{USERS_SERVICE_URL}/api/logout", json=request.get_json())
+        response = users_client.post('/api/logout', json=request.get_json())
         return response.content, response.status_code
     except requests.RequestException as e:
         return jsonify({'error': f'Users service unavailable: {str(e)}'}), 503
@@ -1557,59 +910,57 @@ def logout():
 @app.route('/api/verify', methods=['POST'])
 def verify_token():
     """Forward token verification to users service"""
-    import requests
-    
     try:
-        response = requests.post(f"{USERS_SERVICE_URL}/api/verify", json=request.get_json())
+        # Verification only reads the session, so it is safe to retry
+        response = users_client.post('/api/verify', json=request.get_json(), retry=True)
         return response.content, response.status_code
     except requests.RequestException as e:
         return jsonify({'error': f'Users service unavailable: {str(e)}'}), 503
 
+def admin_order_rows(orders_with_items):
+    """Convert orders with embedded items to the rows expected by the admin template"""
+    return [{
+        'id': order['id'],
+        'name': item['album_name'],
+        'artist': item['artist'],
+        'quantity': item['quantity'],
+        'price': item['price']
+    } for order in orders_with_items for item in order['items']]
+
 @app.route('/admin')
 def admin_panel():
     """Admin panel - authentication handled by JavaScript"""
-    import requests
-    
-    # Get albums from main store database
-    with get_db_connection() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute('SELECT * FROM albums ORDER BY created_at DESC')
-            albums = cur.fetchall()
+    # Get albums from the cached store catalog
+    albums = catalog.albums()
     
     # Get orders from order service
     orders = []
     total_revenue = 0
     try:
-        print(f"Fetching orders from: {ORDER_SERVICE_URL}/api/orders")
-        response = requests.get(f"{ORDER_SERVICE_URL}/api/orders", timeout=5)
-        print(f"Order service response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            orders_data = response.json()
-            print(f"Found {len(orders_data)} orders")
+        print(f"Fetching orders from: {ORDER_SERVICE_URL}/api/orders/with-items")
+        # Orders come back with their items embedded, one page per round-trip
+        cursor = None
+        order_count = 0
+        while True:
+            params = {'limit': ADMIN_ORDERS_PAGE_SIZE}
+            if cursor:
+                params['cursor'] = cursor
+            response = order_client.get('/api/orders/with-items', params=params)
             
-            # Convert to the format expected by the template
-            for order in orders_data:
-                print(f"Processing order {order['id']}")
-                # Get order details with items
-                order_detail_response = requests.get(f"{ORDER_SERVICE_URL}/api/orders/{order['id']}", timeout=5)
-                if order_detail_response.status_code == 200:
-                    order_detail = order_detail_response.json()
-                    print(f"Order {order['id']} has {len(order_detail.get('items', []))} items")
-                    for item in order_detail.get('items', []):
-                        orders.append({
-                            'id': order['id'],
-                            'name': item['album_name'],
-                            'artist': item['artist'],
-                            'quantity': item['quantity'],
-                            'price': item['price']
-                        })
-                        total_revenue += item['price'] * item['quantity']
-                else:
-                    print(f"Failed to get details for order {order['id']}: {order_detail_response.status_code}")
-        else:
-            print(f"Failed to fetch orders: {response.status_code}")
-            print(f"Response content: {response.text}")
+            if response.status_code != 200:
+                print(f"Failed to fetch orders: {response.status_code}")
+                print(f"Response content: {response.text}")
+                break
+            
+            page = response.json()
+            order_count += len(page['orders'])
+            orders.extend(admin_order_rows(page['orders']))
+            
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        print(f"Found {order_count} orders")
+        total_revenue = sum(o['price'] * o['quantity'] for o in orders)
     except requests.RequestException as e:
         print(f"Error fetching orders: {e}")
         # Fallback to empty orders if order service is unavailable
@@ -1623,7 +974,7 @@ def admin_panel():
     print(f"Final stats - Orders: {len(orders)}, Revenue: ${total_revenue}")
     
     # Let JavaScript handle authentication
-    return render_template_string(ADMIN_HTML, albums=albums, orders=orders, total_revenue=total_revenue, ORDER_SERVICE_URL=ORDER_SERVICE_URL, user=None)
+    return render_template(TEMPLATES['admin.html'], albums=albums, orders=orders, total_revenue=total_revenue, ORDER_SERVICE_URL=ORDER_SERVICE_URL, user=None)
 
 @app.route('/admin/logout', methods=['POST'])
 def admin_logout():
@@ -1636,10 +987,8 @@ def admin_logout():
 @app.route('/test-order-service')
 def test_order_service():
     """Test endpoint to check order service connectivity"""
-    import requests
-    
     try:
-        response = requests.get(f"{ORDER_SERVICE_URL}/api/orders", timeout=5)
+        response = order_client.get('/api/orders')
         return jsonify({
             'status': 'success',
             'order_service_url': ORDER_SERVICE_URL,
@@ -1653,5 +1002,56 @@ def test_order_service():
             'error': str(e)
         })
 
+@app.cli.command('index-covers')
+def index_covers_command():
+    """Copy legacy cover files into the content-addressed store and repoint albums at them.
+
+    The legacy files are kept; delete them by hand once the albums have been checked.
+    Also fills in the dominant color and placeholder of every stored cover that lacks them.
+    """
+    mapping = index_legacy_covers(cover_store, LEGACY_COVER_DIRS)
+    updated = 0
+    summarized = 0
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            for filename, cover_name in mapping.items():
+                cur.execute('UPDATE albums SET cover_url = %s WHERE cover_url = %s',
+                            (cover_store_url(cover_name), f'/static/covers/{filename}'))
+                updated += cur.rowcount
+
+            cur.execute("SELECT DISTINCT cover_url FROM albums WHERE cover_url LIKE '/covers/%%' AND cover_color IS NULL")
+            for (url,) in cur.fetchall():
+                cover_name = url[len('/covers/'):]
+                if not cover_store.exists(cover_name):
+                    continue
+                cover_color, cover_placeholder = summarize_cover(cover_name)
+                if cover_color is None:
+                    continue
+                cur.execute('UPDATE albums SET cover_color = %s, cover_placeholder = %s WHERE cover_url = %s',
+                            (cover_color, cover_placeholder, url))
+                summarized += cur.rowcount
+        conn.commit()
+    catalog.invalidate()
+    print(f"Indexed {len(mapping)} files as {len(set(mapping.values()))} unique covers, updated {updated} albums, "
+          f"computed placeholders for {summarized} albums")
+
+@app.cli.command('mirror-covers')
+def mirror_covers_command():
+    """Mirror every external album cover into the cover store and wait for the downloads"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, cover_url FROM albums WHERE cover_url LIKE 'http%%'")
+            albums = [(album_id, url) for album_id, url in cur.fetchall() if is_external(url)]
+    for album_id, url in albums:
+        cover_mirror.submit(album_id, url)
+    cover_mirror.wait_idle()
+    stats = cover_mirror.stats()
+    print(f"Mirrored {stats['mirrored']} of {len(albums)} external covers, {stats['failed']} failed")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+    if os.environ.get('GATEWAY_MODE') == 'asgi':
+        # Asynchronous gateway mode, see asgi_gateway.py
+        import uvicorn
+        uvicorn.run('asgi_gateway:application', host='0.0.0.0', port=5000)
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,443 @@
+"""Asynchronous (ASGI) gateway mode for the store service
+
+Run with ``uvicorn asgi_gateway:application --port 5000`` or
+``GATEWAY_MODE=asgi python app.py``. The proxy and admin routes are served
+by non-blocking handlers (httpx for the downstream services, asyncpg for
+the database), so a slow downstream call no longer ties up a worker and one
+process can hold thousands of requests in flight. Every other route is
+handed to the regular Flask app unchanged.
+"""
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import parse_qsl
+
+import asyncpg
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.responses import (HTMLResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response,
+                                 StreamingResponse)
+from starlette.routing import Mount, Route
+
+import app as store
+from common.http_client import FAILURE_STATUSES, PASSTHROUGH_RESPONSE_HEADERS, passthrough_headers
+from common.metrics import DOWNSTREAM_DURATION, REQUEST_DURATION, REQUESTS_IN_PROGRESS, observe_query
+from common import deadlines
+from common.resilience import CircuitOpenError
+from common.tracing import finish_server_span, start_server_span, start_span
+
+# Concurrent downstream connections per service; idle keep-alive connections are capped by HTTP_POOL_SIZE
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', '1000'))
+
+clients = {}
+_db_pool = None
+_db_pool_lock = asyncio.Lock()
+
+
+class BreakerTransport(httpx.AsyncBaseTransport):
+    """Sends requests through the circuit breaker of the matching synchronous ServiceClient"""
+
+    def __init__(self, transport, breaker):
+        self.transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            raise httpx.ConnectError(str(e), request=request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        if response.status_code in FAILURE_STATUSES:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _async_client(service_client):
+    """httpx client sharing the timeouts and circuit breaker of a synchronous ServiceClient"""
+    connect_timeout, read_timeout = service_client.timeout
+
+    async def start_timer(request):
+        budget = deadlines.header_value()
+        if budget is not None:
+            deadlines.check_deadline(f'calling the {service_client.name} service')
+            request.headers[deadlines.DEADLINE_HEADER] = budget
+            request.extensions['timeout'] = {name: None if value is None else deadlines.bounded_timeout(value)
+                                             for name, value in request.extensions['timeout'].items()}
+        request.extensions['metrics_start'] = time.perf_counter()
+        span = start_span(f'{request.method} {service_client.name}{request.url.path}', 'client',
+                          **{'peer.service': service_client.name})
+        if span is not None:
+            request.headers['traceparent'] = span.traceparent
+            request.extensions['trace_span'] = span
+
+    async def record_response(response):
+        request = response.request
+        elapsed = time.perf_counter() - request.extensions['metrics_start']
+        DOWNSTREAM_DURATION.labels(service_client.name, request.method, response.status_code).observe(elapsed)
+        span = request.extensions.get('trace_span')
+        if span is not None:
+            span.set('http.status_code', response.status_code)
+            span.end(elapsed)
+
+    client = httpx.AsyncClient(
+        base_url=service_client.base_url,
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        transport=BreakerTransport(
+            httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                                                         max_keepalive_connections=store.HTTP_POOL_SIZE)),
+            service_client.breaker),
+        event_hooks={'request': [start_timer], 'response': [record_response]}
+    )
+    # Shared by every user of this process, so never remember downstream cookies
+    client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return client
+
+
+async def get_db_pool():
+    """asyncpg pool, created on first use so the gateway starts without the database"""
+    global _db_pool
+    async with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = await asyncpg.create_pool(
+                host=store.DB_HOST,
+                port=int(store.DB_PORT),
+                database=store.DB_NAME,
+                user=store.DB_USER,
+                password=store.DB_PASSWORD,
+                min_size=store.DB_POOL_MIN,
+                max_size=store.DB_POOL_MAX,
+                timeout=store.DB_POOL_TIMEOUT
+            )
+    return _db_pool
+
+
+# --- Flask session compatibility ---
+
+def _serializer():
+    return store.app.session_interface.get_signing_serializer(store.app)
+
+
+def load_session(request):
+    """Read the Flask session cookie so both modes share cart session ids"""
+    cookie = request.cookies.get(store.app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    try:
+        max_age = int(store.app.permanent_session_lifetime.total_seconds())
+        return dict(_serializer().loads(cookie, max_age=max_age))
+    except BadSignature:
+        return {}
+
+
+def save_session(response, data):
+    config = store.app.config
+    response.set_cookie(
+        config['SESSION_COOKIE_NAME'],
+        _serializer().dumps(data),
+        path=config['SESSION_COOKIE_PATH'] or '/',
+        httponly=config['SESSION_COOKIE_HTTPONLY'],
+        secure=config['SESSION_COOKIE_SECURE'],
+        samesite=config['SESSION_COOKIE_SAMESITE']
+    )
+    return response
+
+
+async def read_form(request):
+    """Parse an urlencoded form body into a list of (name, value) pairs"""
+    body = await request.body()
+    return parse_qsl(body.decode('utf-8'), keep_blank_values=True)
+
+
+def relay(upstream):
+    """Buffered response relaying a downstream status, body and content type"""
+    return Response(upstream.content, status_code=upstream.status_code,
+                    media_type=upstream.headers.get('content-type'))
+
+
+async def stream_page(request, path, session_id):
+    """Relay a cart-service page chunk by chunk, like stream_response() in sync mode"""
+    client = clients['cart']
+    upstream = await client.send(
+        client.build_request('GET', path, params={'session_id': session_id},
+                             headers=passthrough_headers(request)),
+        stream=True
+    )
+    headers = {name: upstream.headers[name] for name in PASSTHROUGH_RESPONSE_HEADERS if name in upstream.headers}
+    return StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code, headers=headers,
+                             background=BackgroundTask(upstream.aclose))
+
+
+def cart_unavailable(error):
+    return HTMLResponse(f"Error connecting to cart service: {str(error)}", status_code=503)
+
+
+def timed(route, endpoint):
+    """Record an async endpoint in the same request metrics and traces, under the same deadline, as the Flask routes"""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        REQUESTS_IN_PROGRESS.labels(request.method, route).inc()
+        span, token = start_server_span('store', f'{request.method} {route}', request.headers.get('traceparent'))
+        budget = deadlines.request_budget(request.headers.get(deadlines.DEADLINE_HEADER))
+        deadline_token = deadlines.start(budget)
+        start = time.perf_counter()
+        status = 500
+        try:
+            try:
+                deadlines.check_deadline('handling the request')
+                response = await endpoint(request)
+            except deadlines.DeadlineExceeded as e:
+                response = PlainTextResponse(str(e), status_code=504)
+            status = response.status_code
+            response.headers['X-Trace-Id'] = span.trace.trace_id
+            return response
+        finally:
+            REQUEST_DURATION.labels(request.method, route, status).observe(time.perf_counter() - start)
+            REQUESTS_IN_PROGRESS.labels(request.method, route).dec()
+            span.set('http.status_code', status)
+            deadlines.finish(deadline_token)
+            finish_server_span(span, token)
+    return wrapper
+
+
+def timed_route(path, endpoint, **kwargs):
+    return Route(path, timed(path, endpoint), **kwargs)
+
+
+# --- Routes ---
+
+async def view_cart(request):
+    """Forward request to cart service"""
+    session = load_session(request)
+    session_id = session.get('cart_session_id')
+    created = not session_id
+    if created:
+        session_id = session['cart_session_id'] = os.urandom(16).hex()
+    try:
+        response = await stream_page(request, '/', session_id)
+    except httpx.HTTPError as e:
+        response = cart_unavailable(e)
+    return save_session(response, session) if created else response
+
+
+async def checkout(request):
+    """Forward request to cart service checkout"""
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return RedirectResponse('/cart', status_code=302)
+    try:
+        return await stream_page(request, '/checkout', session_id)
+    except httpx.HTTPError as e:
+        return cart_unavailable(e)
+
+
+async def order_success(request):
+    """Forward order success to cart service"""
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return RedirectResponse('/', status_code=302)
+    try:
+        return await stream_page(request, '/order_success', session_id)
+    except httpx.HTTPError as e:
+        return cart_unavailable(e)
+
+
+async def process_payment(request):
+    """Forward payment processing to cart service"""
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return RedirectResponse('/cart', status_code=302)
+    form = dict(await read_form(request))
+    form['session_id'] = session_id
+    try:
+        response = await clients['cart'].post('/process_payment', data=form)
+    except httpx.HTTPError as e:
+        return cart_unavailable(e)
+
+    # Handle redirects from cart service
+    if response.is_redirect:
+        redirect_url = response.headers.get('Location', '')
+        if redirect_url.startswith('/payment/'):
+            # The payment is being processed in the background; its status page has the outcome
+            return RedirectResponse(redirect_url, status_code=303)
+        if redirect_url.startswith('/'):
+            return RedirectResponse('/order_success', status_code=302)
+        return RedirectResponse(redirect_url, status_code=302)
+    return relay(response)
+
+
+async def payment_status(request):
+    """Forward the payment status page to cart service"""
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return RedirectResponse('/', status_code=302)
+    try:
+        return await stream_page(request, f"/payment/{request.path_params['payment_id']}", session_id)
+    except httpx.HTTPError as e:
+        return cart_unavailable(e)
+
+
+async def payment_status_api(request):
+    """Forward payment status polling to cart service"""
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return JSONResponse({'error': 'Payment not found'}, status_code=404)
+    try:
+        response = await clients['cart'].get(f"/api/payments/{request.path_params['payment_id']}",
+                                              params={'session_id': session_id})
+    except httpx.HTTPError as e:
+        return JSONResponse({'error': f'Cart service unavailable: {str(e)}'}, status_code=503)
+    return Response(response.content, status_code=response.status_code, media_type='application/json',
+                    headers={'Cache-Control': 'no-store'})
+
+
+async def forward_cart_form(request, path, fields):
+    session_id = load_session(request).get('cart_session_id')
+    if not session_id:
+        return RedirectResponse('/cart', status_code=302)
+    form = dict(await read_form(request))
+    try:
+        data = {field: form[field] for field in fields}
+    except KeyError as e:
+        return HTMLResponse(f"Missing form field: {e.args[0]}", status_code=400)
+    data['session_id'] = session_id
+    try:
+        response = await clients['cart'].post(path, data=data)
+        if response.is_redirect:
+            # The redirect names the cart only by the cart service's own session cookie, which the
+            # gateway does not keep, so load the cart page by session id like view_cart
+            return await stream_page(request, '/', session_id)
+    except httpx.HTTPError as e:
+        return cart_unavailable(e)
+    return relay(response)
+
+
+async def remove_item(request):
+    """Forward remove item request to cart service"""
+    return await forward_cart_form(request, '/remove_item', ('item_id',))
+
+
+async def update_quantity(request):
+    """Forward update quantity request to cart service"""
+    return await forward_cart_form(request, '/update_quantity', ('item_id', 'quantity'))
+
+
+async def forward_users(request, path):
+    try:
+        response = await clients['users'].post(path, content=await request.body(),
+                                               headers={'Content-Type': 'application/json'})
+    except httpx.HTTPError as e:
+        return JSONResponse({'error': f'Users service unavailable: {str(e)}'}, status_code=503)
+    return relay(response)
+
+
+async def login(request):
+    """Forward login request to users service"""
+    return await forward_users(request, '/api/login')
+
+
+async def logout(request):
+    """Forward logout request to users service"""
+    return await forward_users(request, '/api/logout')
+
+
+async def verify_token(request):
+    """Forward token verification to users service"""
+    return await forward_users(request, '/api/verify')
+
+
+async def fetch_admin_orders():
+    """All orders with their items, one page per order-service round-trip"""
+    orders = []
+    cursor = None
+    while True:
+        params = {'limit': store.ADMIN_ORDERS_PAGE_SIZE}
+        if cursor:
+            params['cursor'] = cursor
+        response = await clients['order'].get('/api/orders/with-items', params=params)
+        if response.status_code != 200:
+            print(f"Failed to fetch orders: {response.status_code}")
+            break
+        page = response.json()
+        orders.extend(store.admin_order_rows(page['orders']))
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    return orders
+
+
+async def fetch(sql, *args):
+    """Run a query on the asyncpg pool, recording it like the psycopg2 queries"""
+    pool = await get_db_pool()
+    start = time.perf_counter()
+    try:
+        return await pool.fetch(sql, *args)
+    finally:
+        observe_query('postgresql', sql, time.perf_counter() - start)
+
+
+async def admin_panel(request):
+    """Admin panel - authentication handled by JavaScript"""
+    albums_query = fetch('SELECT * FROM albums ORDER BY created_at DESC, id DESC')
+    # The database and the order service are queried concurrently
+    albums, orders = await asyncio.gather(albums_query, fetch_admin_orders(), return_exceptions=True)
+    if isinstance(albums, BaseException):
+        raise albums
+    if isinstance(orders, BaseException):
+        print(f"Error fetching orders: {orders}")
+        orders = []
+    total_revenue = sum(o['price'] * o['quantity'] for o in orders)
+
+    html = store.TEMPLATES['admin.html'].render(albums=albums, orders=orders, total_revenue=total_revenue,
+                                                ORDER_SERVICE_URL=store.ORDER_SERVICE_URL, user=None)
+    return HTMLResponse(html)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    clients['cart'] = _async_client(store.cart_client)
+    clients['order'] = _async_client(store.order_client)
+    clients['users'] = _async_client(store.users_client)
+    yield
+    for client in clients.values():
+        await client.aclose()
+    if _db_pool is not None:
+        await _db_pool.close()
+
+
+application = Starlette(
+    routes=[
+        timed_route('/cart', view_cart),
+        timed_route('/checkout', checkout),
+        timed_route('/order_success', order_success),
+        timed_route('/process_payment', process_payment, methods=['POST']),
+        timed_route('/payment/{payment_id}', payment_status),
+        timed_route('/api/payments/{payment_id}', payment_status_api),
+        timed_route('/remove_item', remove_item, methods=['POST']),
+        timed_route('/update_quantity', update_quantity, methods=['POST']),
+        timed_route('/api/login', login, methods=['POST']),
+        timed_route('/api/logout', logout, methods=['POST']),
+        timed_route('/api/verify', verify_token, methods=['POST']),
+        timed_route('/admin', admin_panel),
+        # Everything else is served by the synchronous Flask app
+        Mount('/', app=WsgiToAsgi(store.app)),
+    ],
+    lifespan=lifespan
+)
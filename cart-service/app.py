@@ -1,34 +1,97 @@
-from flask import Flask, render_template_string, request, redirect, url_for, session, jsonify
-import sqlite3
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify
 import os
+import sys
 import requests
 import json
 
+# Shared helpers live in common/ at the repository root (copied to /common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.templating import register_templates
+from common.assets import register_assets
+from common.compression import init_compression
+from common.http_client import ServiceClient
+from common.metrics import init_metrics
+from common.sqlite_db import SqliteDatabase
+from common.tracing import current_span, init_tracing
+from common.deadlines import check_deadline, init_deadlines
+from cart_backends import MemoryCartBackend, PostgresCartBackend, SqliteCartBackend
+from payment_jobs import DECLINED, FAILED, PENDING, PROCESSING, SUCCEEDED, OrderError, PaymentJobs
+from payments import HttpPaymentProvider, SimulatedPaymentProvider
+
 app = Flask(__name__)
 app.secret_key = 'cart-secret-key-here'
+init_metrics(app)
+init_tracing(app, 'cart')
+init_deadlines(app)
+compressor = init_compression(app)
 
 # Configuration
+# Where carts are kept: sqlite (CART_DB_PATH, one pod), memory (tests) or postgres (shared, any number of replicas)
+CART_BACKEND = os.environ.get('CART_BACKEND', 'sqlite')
 CART_DB_PATH = os.environ.get('CART_DB_PATH', 'cart.db')
 ORDER_SERVICE_URL = os.environ.get('ORDER_SERVICE_URL', 'http://localhost:5001')
 STORE_SERVICE_URL = os.environ.get('STORE_SERVICE_URL', 'http://localhost:5000')
 
-def init_cart_db():
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS cart_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            album_id INTEGER NOT NULL,
-            album_name TEXT NOT NULL,
-            artist TEXT NOT NULL,
-            price REAL NOT NULL,
-            quantity INTEGER NOT NULL,
-            cover_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )''')
-        conn.commit()
+# Who authorizes card payments: simulated (in-process, see payments.py for its PAYMENT_* settings) or http
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'simulated')
+PAYMENT_PROVIDER_URL = os.environ.get('PAYMENT_PROVIDER_URL', 'http://localhost:5004')
+# Payments are authorized and turned into orders by this many background threads
+PAYMENT_WORKERS = int(os.environ.get('PAYMENT_WORKERS', '16'))
+
+# Shared keep-alive HTTP clients for the downstream services
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '2'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+store_client = ServiceClient('store', STORE_SERVICE_URL,
+                             timeout=float(os.environ.get('STORE_SERVICE_TIMEOUT', '5')),
+                             connect_timeout=HTTP_CONNECT_TIMEOUT, max_retries=HTTP_MAX_RETRIES)
+order_client = ServiceClient('order', ORDER_SERVICE_URL,
+                             timeout=float(os.environ.get('ORDER_SERVICE_TIMEOUT', '10')),
+                             connect_timeout=HTTP_CONNECT_TIMEOUT, max_retries=HTTP_MAX_RETRIES)
+
+def create_cart_backend():
+    """The cart storage selected by CART_BACKEND (sqlite, memory or postgres)"""
+    if CART_BACKEND == 'memory':
+        return MemoryCartBackend()
+    if CART_BACKEND == 'postgres':
+        connect = PostgresCartBackend.connector(
+            host=os.environ.get('DB_HOST', 'localhost'),
+            port=os.environ.get('DB_PORT', '5432'),
+            database=os.environ.get('DB_NAME', 'music_store'),
+            user=os.environ.get('DB_USER', 'music_user'),
+            password=os.environ.get('DB_PASSWORD', 'music_password'))
+        return PostgresCartBackend(connect, maxconn=int(os.environ.get('DB_POOL_MAX', '10')),
+                                   timeout=float(os.environ.get('DB_POOL_TIMEOUT', '5')))
+    if CART_BACKEND != 'sqlite':
+        raise ValueError(f'Unknown CART_BACKEND {CART_BACKEND!r} (expected sqlite, memory or postgres)')
+    return SqliteCartBackend(SqliteDatabase(CART_DB_PATH))
+
+carts = create_cart_backend()
+
+def create_payment_provider():
+    """The payment provider selected by PAYMENT_PROVIDER (simulated or http)"""
+    if PAYMENT_PROVIDER == 'http':
+        return HttpPaymentProvider(PAYMENT_PROVIDER_URL)
+    if PAYMENT_PROVIDER != 'simulated':
+        raise ValueError(f'Unknown PAYMENT_PROVIDER {PAYMENT_PROVIDER!r} (expected simulated or http)')
+    return SimulatedPaymentProvider()
+
+payment_provider = create_payment_provider()
+
+def place_order(order_data):
+    """Create the order and empty the cart; returns the order service's answer (order id and number)"""
+    try:
+        response = order_client.post('/api/orders', json=order_data)
+    except requests.RequestException:
+        raise OrderError("Order service unavailable. Please try again later.")
+    if response.status_code != 201:
+        raise OrderError("Order processing failed. Please try again.")
+    # Clear cart after successful order
+    carts.clear(order_data['session_id'])
+    return response.json()
 
-init_cart_db()
+# A payment still pending well after the provider timeout has lost its worker
+payment_jobs = PaymentJobs(carts, payment_provider.authorize, place_order, workers=PAYMENT_WORKERS,
+                           stale_after=payment_provider.timeout + 60)
 
 @app.route('/')
 def cart():
@@ -42,17 +105,11 @@ def cart():
         # Use the provided session_id and store it in our session
         session['session_id'] = session_id
     
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        cart_items = c.execute('''
-            SELECT * FROM cart_items 
-            WHERE session_id = ? 
-            ORDER BY created_at DESC
-        ''', (session_id,)).fetchall()
+    cart_items = carts.items(session_id)
     
     total = sum(item[6] * item[5] for item in cart_items)  # quantity * price
     
-    return render_template_string(CART_HTML, cart_items=cart_items, total=total)
+    return render_template(TEMPLATES['cart.html'], cart_items=cart_items, total=total)
 
 @app.route('/add_to_cart', methods=['POST'])
 def add_to_cart():
@@ -78,9 +135,7 @@ def add_to_cart():
     # If album details not provided, try to get from store service
     if not album_name or not artist:
         try:
-            api_url = f"{STORE_SERVICE_URL}/api/album/{album_id}"
-            print(f"DEBUG: Trying to connect to store service at: {api_url}")
-            response = requests.get(api_url, timeout=5)
+            response = store_client.get(f"/api/album/{album_id}")
             if response.status_code == 200:
                 album = response.json()
                 album_name = album['name']
@@ -93,32 +148,9 @@ def add_to_cart():
             print(f"DEBUG: Request failed: {e}")
             return jsonify({'error': f'Store service unavailable: {str(e)}'}), 503
     
-    # Add to cart
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        
-        # Check if item already in cart
-        existing = c.execute('''
-            SELECT id, quantity FROM cart_items 
-            WHERE session_id = ? AND album_id = ?
-        ''', (session_id, album_id)).fetchone()
-        
-        if existing:
-            # Update quantity
-            new_quantity = existing[1] + quantity
-            c.execute('''
-                UPDATE cart_items 
-                SET quantity = ? 
-                WHERE id = ?
-            ''', (new_quantity, existing[0]))
-        else:
-            # Add new item
-            c.execute('''
-                INSERT INTO cart_items (session_id, album_id, album_name, artist, price, quantity, cover_url)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (session_id, album_id, album_name, artist, price, quantity, cover_url))
-        
-        conn.commit()
+    # Add to cart, or add to the quantity if the album is already in it
+    check_deadline('updating the cart')
+    carts.add(session_id, album_id, album_name, artist, price, quantity, cover_url)
     
     # Return JSON response with session_id for store service to use
     return jsonify({
@@ -142,21 +174,14 @@ def update_quantity():
     
     item_id = int(request.form['item_id'])
     quantity = int(request.form['quantity'])
+    check_deadline('updating the cart')
     
     if quantity <= 0:
         # Remove item
-        with sqlite3.connect(CART_DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute('DELETE FROM cart_items WHERE id = ? AND session_id = ?', 
-                     (item_id, session_id))
-            conn.commit()
+        carts.remove(session_id, item_id)
     else:
         # Update quantity
-        with sqlite3.connect(CART_DB_PATH) as conn:
-            c = conn.cursor()
-            c.execute('UPDATE cart_items SET quantity = ? WHERE id = ? AND session_id = ?', 
-                     (quantity, item_id, session_id))
-            conn.commit()
+        carts.set_quantity(session_id, item_id, quantity)
     
     return redirect(url_for('cart'))
 
@@ -173,12 +198,9 @@ def remove_item():
         session['session_id'] = session_id
     
     item_id = int(request.form['item_id'])
+    check_deadline('updating the cart')
     
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        c.execute('DELETE FROM cart_items WHERE id = ? AND session_id = ?', 
-                 (item_id, session_id))
-        conn.commit()
+    carts.remove(session_id, item_id)
     
     return redirect(url_for('cart'))
 
@@ -194,20 +216,14 @@ def checkout():
         # Use the provided session_id and store it in our session
         session['session_id'] = session_id
     
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        cart_items = c.execute('''
-            SELECT * FROM cart_items 
-            WHERE session_id = ? 
-            ORDER BY created_at DESC
-        ''', (session_id,)).fetchall()
+    cart_items = carts.items(session_id)
     
     if not cart_items:
         return redirect(url_for('cart'))
     
     total = sum(item[6] * item[5] for item in cart_items)
     
-    return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total)
+    return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total)
 
 @app.route('/process_payment', methods=['POST'])
 def process_payment():
@@ -222,12 +238,7 @@ def process_payment():
         session['session_id'] = session_id
     
     # Get cart items
-    with sqlite3.connect(CART_DB_PATH) as conn:
-        c = conn.cursor()
-        cart_items = c.execute('''
-            SELECT * FROM cart_items 
-            WHERE session_id = ?
-        ''', (session_id,)).fetchall()
+    cart_items = carts.items(session_id)
     
     if not cart_items:
         return redirect(url_for('cart'))
@@ -245,7 +256,7 @@ def process_payment():
     for field in required_fields:
         if not request.form.get(field, '').strip():
             total = sum(item[6] * item[5] for item in cart_items)
-            return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
+            return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total, 
                                         error=f"Please fill in all required fields. Missing: {field.replace('_', ' ').title()}")
     
     # Validate payment details
@@ -257,17 +268,17 @@ def process_payment():
     # Enhanced validation
     if len(card_number) < 13 or len(card_number) > 19:
         total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
+        return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total, 
                                     error="Invalid card number. Please enter a valid credit card number.")
     
     if len(cvv) < 3 or len(cvv) > 4:
         total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
+        return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total, 
                                     error="Invalid CVV. Please enter a valid 3 or 4 digit CVV.")
     
     if len(cardholder_name) < 2:
         total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
+        return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total, 
                                     error="Please enter the cardholder name as it appears on the card.")
     
     # Validate email format
@@ -276,20 +287,9 @@ def process_payment():
     email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     if not re.match(email_pattern, email):
         total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
+        return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total, 
                                     error="Please enter a valid email address.")
     
-    # Simulate processing delay
-    import time
-    time.sleep(2)
-    
-    # Simulate random payment failures (3% chance)
-    import random
-    if random.random() < 0.03:
-        total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
-                                    error="Payment declined. Please check your card details and try again.")
-    
     # Prepare order data with shipping and billing information
     order_data = {
         'session_id': session_id,
@@ -330,27 +330,48 @@ def process_payment():
         }
     }
     
-    try:
-        response = requests.post(f"{ORDER_SERVICE_URL}/api/orders", json=order_data)
-        if response.status_code == 201:
-            # Clear cart after successful order
-            with sqlite3.connect(CART_DB_PATH) as conn:
-                c = conn.cursor()
-                c.execute('DELETE FROM cart_items WHERE session_id = ?', (session_id,))
-                conn.commit()
-            
-            # Store order details in session for success page
-            session['order_details'] = order_data
-            
-            return redirect(url_for('order_success'))
-        else:
-            total = sum(item[6] * item[5] for item in cart_items)
-            return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
-                                        error="Order processing failed. Please try again.")
-    except requests.RequestException:
+    # Authorize the payment and place the order in the background; the status page polls for the outcome
+    check_deadline('starting the payment')
+    request_span = current_span()
+    payment_id = payment_jobs.submit(session_id, order_data,
+                                     request_span.traceparent if request_span is not None else None)
+    return redirect(url_for('payment_status', payment_id=payment_id), code=303)
+
+def find_payment(payment_id):
+    """The payment, unless it is missing or belongs to another cart than the request's session_id"""
+    payment = payment_jobs.status(payment_id)
+    session_id = request.args.get('session_id')
+    if payment is None or (session_id and payment.session_id != session_id):
+        return None
+    return payment
+
+@app.route('/payment/<payment_id>')
+def payment_status(payment_id):
+    """Processing page of a payment; shows the outcome once the background job has finished"""
+    payment = find_payment(payment_id)
+    if payment is None:
+        return "Payment not found", 404
+    if payment.status == SUCCEEDED:
+        # Only the order's id and number; the customer's details are not kept after the order is placed
+        session['order_details'] = payment.details
+        return redirect(url_for('order_success'))
+    if payment.status in (DECLINED, FAILED):
+        cart_items = carts.items(payment.session_id)
         total = sum(item[6] * item[5] for item in cart_items)
-        return render_template_string(CHECKOUT_HTML, cart_items=cart_items, total=total, 
-                                    error="Order service unavailable. Please try again later.")
+        return render_template(TEMPLATES['checkout.html'], cart_items=cart_items, total=total,
+                               error=payment.message)
+    return render_template(TEMPLATES['payment.html'], payment=payment)
+
+@app.route('/api/payments/<payment_id>')
+def payment_status_api(payment_id):
+    """Status of a payment for the processing page to poll"""
+    payment = find_payment(payment_id)
+    if payment is None:
+        return jsonify({'error': 'Payment not found'}), 404
+    response = jsonify({'id': payment.id, 'status': payment.status, 'message': payment.message,
+                        'done': payment.status not in (PENDING, PROCESSING)})
+    response.cache_control.no_store = True
+    return response
 
 @app.route('/order_success')
 def order_success():
@@ -361,7 +382,12 @@ def order_success():
         session['session_id'] = session_id
     
     # We don't need order_details for the simplified success page
-    return render_template_string(SUCCESS_HTML)
+    return render_template(TEMPLATES['success.html'])
+
+@app.route('/debug-services')
+def debug_services():
+    """Timeouts and circuit breaker state of each downstream service"""
+    return jsonify({client.name: client.stats() for client in (store_client, order_client)})
 
 # Cart HTML Template
 CART_HTML = '''
@@ -371,207 +397,8 @@ CART_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Shopping Cart - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-        }
-
-        .header-content {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .cart-card {
-            background: white;
-            border-radius: 16px;
-            padding: 30px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e5e9;
-        }
-
-        .cart-item {
-            display: grid;
-            grid-template-columns: 80px 2fr 1fr 1fr auto;
-            gap: 20px;
-            align-items: center;
-            padding: 20px;
-            border-bottom: 1px solid #e1e5e9;
-            transition: all 0.3s ease;
-        }
-
-        .cart-item:last-child {
-            border-bottom: none;
-        }
-
-        .item-cover {
-            width: 60px;
-            height: 60px;
-            object-fit: cover;
-            border-radius: 8px;
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-        }
-
-        .item-info h3 {
-            color: #1a1a1a;
-            margin-bottom: 5px;
-            font-weight: 700;
-        }
-
-        .item-info p {
-            color: #666;
-            font-size: 0.9rem;
-            font-weight: 500;
-        }
-
-        .item-price {
-            font-weight: 800;
-            color: #667eea;
-        }
-
-        .quantity-controls {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-
-        .quantity-controls input {
-            width: 60px;
-            padding: 10px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            text-align: center;
-            background: white;
-            color: #1a1a1a;
-            font-weight: 500;
-            transition: all 0.3s ease;
-        }
-
-        .quantity-controls input:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 12px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .btn-danger {
-            background: linear-gradient(135deg, #e74c3c 0%, #c0392b 100%);
-        }
-
-        .btn-danger:hover {
-            box-shadow: 0 8px 25px rgba(231, 76, 60, 0.3);
-        }
-
-        .cart-total {
-            background: white;
-            border-radius: 12px;
-            padding: 25px;
-            margin-top: 30px;
-            text-align: right;
-            border-left: 4px solid #667eea;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .cart-total h3 {
-            color: #1a1a1a;
-            margin-bottom: 15px;
-            font-weight: 700;
-        }
-
-        .total-amount {
-            font-size: 2.5rem;
-            font-weight: 800;
-            color: #667eea;
-        }
-
-        .cart-actions {
-            display: flex;
-            justify-content: space-between;
-            margin-top: 20px;
-        }
-
-        .empty-cart {
-            text-align: center;
-            padding: 60px 20px;
-            color: #666;
-        }
-
-        .empty-cart p {
-            font-size: 1.1rem;
-            margin-bottom: 20px;
-            font-weight: 500;
-        }
-
-        @media (max-width: 768px) {
-            .cart-item {
-                grid-template-columns: 1fr;
-                gap: 10px;
-                text-align: center;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .container {
-                padding: 0 16px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/cart.css') }}">
 </head>
 <body>
     <div class="container">
@@ -648,247 +475,8 @@ CHECKOUT_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Checkout - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-            text-align: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .checkout-card {
-            background: white;
-            border-radius: 16px;
-            padding: 40px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e5e9;
-        }
-
-        .order-summary {
-            background: white;
-            border-radius: 12px;
-            padding: 25px;
-            margin-bottom: 30px;
-            border-left: 4px solid #667eea;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .order-summary h3 {
-            color: #1a1a1a;
-            margin-bottom: 15px;
-            font-size: 1.3rem;
-            font-weight: 700;
-        }
-
-        .order-item {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 10px;
-            padding: 10px 0;
-            border-bottom: 1px solid #e1e5e9;
-            color: #1a1a1a;
-        }
-
-        .order-item:last-child {
-            border-bottom: none;
-        }
-
-        .order-total {
-            border-top: 2px solid #e1e5e9;
-            padding-top: 15px;
-            margin-top: 15px;
-            font-size: 1.2rem;
-            font-weight: bold;
-            color: #667eea;
-            display: flex;
-            justify-content: space-between;
-        }
-
-        .form-section {
-            margin-bottom: 40px;
-        }
-
-        .form-section h3 {
-            color: #1a1a1a;
-            margin-bottom: 20px;
-            font-size: 1.3rem;
-            border-bottom: 2px solid #e1e5e9;
-            padding-bottom: 10px;
-            font-weight: 700;
-        }
-
-        .form-row {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 20px;
-        }
-
-        .form-group {
-            margin-bottom: 20px;
-        }
-
-        .form-group.full-width {
-            grid-column: 1 / -1;
-        }
-
-        .form-group label {
-            display: block;
-            margin-bottom: 8px;
-            font-weight: 600;
-            color: #1a1a1a;
-            font-size: 0.9rem;
-        }
-
-        .form-group input, .form-group select {
-            width: 100%;
-            padding: 14px 16px;
-            border: 2px solid #e1e5e9;
-            border-radius: 8px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease;
-            background: white;
-            color: #1a1a1a;
-        }
-
-        .form-group input:focus, .form-group select:focus {
-            outline: none;
-            border-color: #667eea;
-        }
-
-        .card-row {
-            display: grid;
-            grid-template-columns: 2fr 1fr 1fr;
-            gap: 15px;
-        }
-
-        .checkbox-group {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            margin-bottom: 20px;
-        }
-
-        .checkbox-group input[type="checkbox"] {
-            width: auto;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 15px 30px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            width: 100%;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .btn:disabled {
-            opacity: 0.6;
-            cursor: not-allowed;
-            transform: none;
-        }
-
-        .error-message {
-            background: #f8d7da;
-            color: #721c24;
-            padding: 12px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-            border: 1px solid #f5c6cb;
-        }
-
-        .back-link {
-            text-align: center;
-            margin-top: 20px;
-        }
-
-        .back-link a {
-            color: #667eea;
-            text-decoration: none;
-            font-weight: 600;
-        }
-
-        .back-link a:hover {
-            text-decoration: underline;
-        }
-
-        .loading {
-            display: none;
-            text-align: center;
-            margin: 20px 0;
-        }
-
-        .spinner {
-            border: 3px solid #f3f3f3;
-            border-top: 3px solid #667eea;
-            border-radius: 50%;
-            width: 30px;
-            height: 30px;
-            animation: spin 1s linear infinite;
-            margin: 0 auto 10px;
-        }
-
-        @keyframes spin {
-            0% { transform: rotate(0deg); }
-            100% { transform: rotate(360deg); }
-        }
-
-        @media (max-width: 768px) {
-            .form-row, .card-row {
-                grid-template-columns: 1fr;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/checkout.css') }}">
 </head>
 <body>
     <div class="container">
@@ -918,7 +506,7 @@ CHECKOUT_HTML = '''
             </div>
             {% endif %}
 
-            <form action="process_payment" method="post" id="checkout-form">
+            <form action="/process_payment" method="post" id="checkout-form">
                 <!-- Contact Information -->
                 <div class="form-section">
                     <h3>📧 Contact Information</h3>
@@ -1079,97 +667,7 @@ CHECKOUT_HTML = '''
         </div>
     </div>
 
-    <script>
-        // Format card number with spaces
-        document.getElementById('card_number').addEventListener('input', function(e) {
-            let value = e.target.value.replace(/\\s/g, '').replace(/[^0-9]/gi, '');
-            let formattedValue = value.replace(/(.{4})/g, '$1 ').trim();
-            e.target.value = formattedValue;
-        });
-
-        // Format expiry date
-        document.getElementById('expiry').addEventListener('input', function(e) {
-            let value = e.target.value.replace(/[^0-9]/g, '');
-            if (value.length >= 2) {
-                value = value.substring(0, 2) + '/' + value.substring(2, 4);
-            }
-            e.target.value = value;
-        });
-
-        // Only allow numbers for CVV
-        document.getElementById('cvv').addEventListener('input', function(e) {
-            e.target.value = e.target.value.replace(/[^0-9]/g, '');
-        });
-
-        // Same as shipping address functionality
-        document.getElementById('same_as_shipping').addEventListener('change', function(e) {
-            const billingFields = document.getElementById('billing-fields');
-            if (e.target.checked) {
-                billingFields.style.display = 'none';
-                // Copy shipping values to billing
-                document.getElementById('billing_first_name').value = document.getElementById('shipping_first_name').value;
-                document.getElementById('billing_last_name').value = document.getElementById('shipping_last_name').value;
-                document.getElementById('billing_address').value = document.getElementById('shipping_address').value;
-                document.getElementById('billing_city').value = document.getElementById('shipping_city').value;
-                document.getElementById('billing_state').value = document.getElementById('shipping_state').value;
-                document.getElementById('billing_zip').value = document.getElementById('shipping_zip').value;
-                document.getElementById('billing_country').value = document.getElementById('shipping_country').value;
-            } else {
-                billingFields.style.display = 'block';
-            }
-        });
-
-        // Form submission with loading state
-        document.getElementById('checkout-form').addEventListener('submit', function(e) {
-            const submitBtn = document.getElementById('submit-btn');
-            const btnText = document.getElementById('btn-text');
-            const loading = document.getElementById('loading');
-            
-            submitBtn.disabled = true;
-            btnText.textContent = 'Processing...';
-            loading.style.display = 'block';
-        });
-
-        // Auto-fill with sample data for testing
-        function fillSampleData() {
-            const sampleData = {
-                'email': 'test@example.com',
-                'phone': '(555) 123-4567',
-                'shipping_first_name': 'John',
-                'shipping_last_name': 'Doe',
-                'shipping_address': '123 Main Street',
-                'shipping_city': 'New York',
-                'shipping_state': 'NY',
-                'shipping_zip': '10001',
-                'shipping_country': 'US',
-                'billing_first_name': 'John',
-                'billing_last_name': 'Doe',
-                'billing_address': '123 Main Street',
-                'billing_city': 'New York',
-                'billing_state': 'NY',
-                'billing_zip': '10001',
-                'billing_country': 'US',
-                'cardholder_name': 'John Doe',
-                'card_number': '4111 1111 1111 1111',
-                'expiry': '12/25',
-                'cvv': '123'
-            };
-            
-            for (const [key, value] of Object.entries(sampleData)) {
-                const element = document.getElementById(key);
-                if (element) {
-                    element.value = value;
-                }
-            }
-        }
-
-        // Add sample data button for testing (remove in production)
-        const sampleBtn = document.createElement('button');
-        sampleBtn.textContent = 'Fill Sample Data (Testing)';
-        sampleBtn.style.cssText = 'position: fixed; top: 20px; right: 20px; background: #28a745; color: white; border: none; padding: 10px; border-radius: 5px; cursor: pointer; z-index: 1000;';
-        sampleBtn.onclick = fillSampleData;
-        document.body.appendChild(sampleBtn);
-    </script>
+    <script src="{{ asset_url('js/checkout.js') }}"></script>
 </body>
 </html>
 '''
@@ -1181,136 +679,8 @@ SUCCESS_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Order Successful - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-            text-align: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .success-card {
-            background: white;
-            border-radius: 16px;
-            padding: 40px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e5e9;
-            text-align: center;
-        }
-
-        .success-icon {
-            font-size: 4rem;
-            margin-bottom: 20px;
-            color: #667eea;
-        }
-
-        .success-title {
-            color: #1a1a1a;
-            font-size: 2rem;
-            margin-bottom: 15px;
-            font-weight: 700;
-        }
-
-        .success-message {
-            color: #666;
-            font-size: 1.1rem;
-            margin-bottom: 30px;
-            line-height: 1.6;
-        }
-
-        .order-summary {
-            background: white;
-            border-radius: 12px;
-            padding: 25px;
-            margin: 20px 0;
-            border-left: 4px solid #28a745;
-            text-align: left;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .order-summary h4 {
-            color: #28a745;
-            margin-bottom: 15px;
-            font-size: 1.3rem;
-            text-align: center;
-            font-weight: 700;
-        }
-
-        .order-info {
-            color: #1a1a1a;
-            font-size: 1rem;
-            line-height: 1.6;
-            text-align: center;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 15px 30px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 600;
-            transition: all 0.3s ease;
-            text-decoration: none;
-            display: inline-block;
-            margin: 10px;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .btn-secondary {
-            background: #f8f9fa;
-            color: #666;
-            border: 1px solid #e1e5e9;
-        }
-
-        .btn-secondary:hover {
-            background: #e9ecef;
-            box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/success.css') }}">
 </head>
 <body>
     <div class="container">
@@ -1352,5 +722,44 @@ SUCCESS_HTML = '''
 </html>
 '''
 
+PAYMENT_HTML = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Processing Payment - Metal Music Store</title>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/payment.css') }}">
+    <noscript><meta http-equiv="refresh" content="2"></noscript>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>💳 Processing Payment</h1>
+            <p>Hang tight while we confirm your payment</p>
+        </div>
+
+        <div class="payment-card" id="payment-status" data-status-url="{{ url_for('payment_status_api', payment_id=payment.id) }}">
+            <div class="spinner" aria-hidden="true"></div>
+            <h2>Authorizing your card...</h2>
+            <p>This usually takes a few seconds. This page updates by itself, so please don't submit the order again.</p>
+        </div>
+    </div>
+    <script src="{{ asset_url('js/payment.js') }}"></script>
+</body>
+</html>
+'''
+
+# Compile the templates once at startup
+TEMPLATES = register_templates(app, 'cart', {
+    'cart.html': CART_HTML,
+    'checkout.html': CHECKOUT_HTML,
+    'success.html': SUCCESS_HTML,
+    'payment.html': PAYMENT_HTML
+})
+# Content-hashed CSS/JS bundles, served at /assets/cart/ (and proxied there by the store)
+register_assets(app, 'cart', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002, debug=True) 
\ No newline at end of file
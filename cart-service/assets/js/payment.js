@@ -0,0 +1,23 @@
+// Poll the payment status and reload once it is decided; the server then shows the outcome
+const paymentStatus = document.getElementById('payment-status');
+const statusUrl = paymentStatus.dataset.statusUrl;
+
+function pollPayment() {
+    fetch(statusUrl, { headers: { 'Accept': 'application/json' }, cache: 'no-store' })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Payment status unavailable');
+            }
+            return response.json();
+        })
+        .then(payment => {
+            if (payment.done) {
+                window.location.reload();
+            } else {
+                setTimeout(pollPayment, 500);
+            }
+        })
+        .catch(() => setTimeout(pollPayment, 2000));
+}
+
+setTimeout(pollPayment, 500);
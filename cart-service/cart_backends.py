@@ -0,0 +1,381 @@
+"""Storage backends for cart contents
+
+Every backend stores the same rows and returns them as CartItem tuples,
+which keep the column order of the original ``SELECT * FROM cart_items``
+so templates can keep indexing them (``item[6] * item[5]``). Backends
+also keep the state of background payments (Payment tuples), so any
+replica can report on a payment another one is processing.
+
+- SqliteCartBackend: a SQLite file local to the pod (the default)
+- MemoryCartBackend: a dict in this process, for tests and benchmarks
+- PostgresCartBackend: a shared PostgreSQL table, so any number of cart
+  replicas can serve the same carts
+"""
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    import psycopg2
+    from common.pg_pool import ConnectionPool, TimedConnection
+except ImportError:  # only needed for CART_BACKEND=postgres
+    psycopg2 = None
+
+CartItem = namedtuple('CartItem', 'id session_id album_id album_name artist price quantity cover_url created_at')
+# ``details`` is a JSON-serializable dict (the placed order's id and number); ``created_at`` and
+# ``updated_at`` (the last status change) are Unix timestamps
+Payment = namedtuple('Payment', 'id session_id status message details created_at updated_at')
+
+
+class CartBackend(ABC):
+    """Cart storage; items of one cart are identified by (session_id, item id)"""
+
+    @abstractmethod
+    def items(self, session_id):
+        """The cart's items, most recently added first"""
+
+    @abstractmethod
+    def add(self, session_id, album_id, album_name, artist, price, quantity, cover_url):
+        """Put an album in the cart, or add ``quantity`` to it if it is already there"""
+
+    @abstractmethod
+    def set_quantity(self, session_id, item_id, quantity):
+        """Change the quantity of one item"""
+
+    @abstractmethod
+    def remove(self, session_id, item_id):
+        """Take one item out of the cart"""
+
+    @abstractmethod
+    def clear(self, session_id):
+        """Empty the cart"""
+
+    @abstractmethod
+    def save_payment(self, payment, if_status=None):
+        """Insert a payment or replace its status, message, details and updated_at; returns whether it was saved.
+
+        With ``if_status`` an existing payment is only replaced while its
+        status is still ``if_status``, so two writers cannot both move a
+        payment on from the same state.
+        """
+
+    @abstractmethod
+    def payment(self, payment_id):
+        """The payment with this id, or None"""
+
+    @abstractmethod
+    def prune_payments(self, before):
+        """Forget payments created before the Unix timestamp ``before``"""
+
+
+# Schema migrations in order; PRAGMA user_version records how many have been applied
+SQLITE_MIGRATIONS = [
+    # 1: index per-session reads, merge duplicate album rows and make (session_id, album_id) unique
+    [
+        'CREATE INDEX IF NOT EXISTS idx_cart_items_session ON cart_items (session_id, created_at)',
+        '''UPDATE cart_items SET quantity = (
+               SELECT SUM(d.quantity) FROM cart_items d
+               WHERE d.session_id = cart_items.session_id AND d.album_id = cart_items.album_id)
+           WHERE id IN (SELECT MIN(id) FROM cart_items GROUP BY session_id, album_id HAVING COUNT(*) > 1)''',
+        'DELETE FROM cart_items WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY session_id, album_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_items_session_album ON cart_items (session_id, album_id)',
+    ],
+    # 2: state of payments processed in the background
+    [
+        '''CREATE TABLE IF NOT EXISTS cart_payments (
+               id TEXT PRIMARY KEY,
+               session_id TEXT NOT NULL,
+               status TEXT NOT NULL,
+               message TEXT,
+               details TEXT,
+               created_at REAL NOT NULL)''',
+        'CREATE INDEX IF NOT EXISTS idx_cart_payments_created_at ON cart_payments (created_at)',
+    ],
+    # 3: time of each payment's last status change, from which a stuck payment is detected
+    [
+        'ALTER TABLE cart_payments ADD COLUMN updated_at REAL',
+    ],
+]
+
+
+class SqliteCartBackend(CartBackend):
+    """Carts in a SQLite file opened through a common.sqlite_db.SqliteDatabase"""
+
+    def __init__(self, db):
+        self.db = db
+        self.migrate()
+
+    def migrate(self):
+        """Create the table and apply the migrations this database has not seen yet, one transaction each"""
+        # A separate connection, so no pooled connection has compiled statements against the old schema
+        conn = self.db.open(isolation_level=None)
+        try:
+            conn.execute('''CREATE TABLE IF NOT EXISTS cart_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                album_id INTEGER NOT NULL,
+                album_name TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                price REAL NOT NULL,
+                quantity INTEGER NOT NULL,
+                cover_url TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            while True:
+                # IMMEDIATE takes the write lock before the version is read, so concurrent
+                # workers starting up apply each migration exactly once
+                conn.execute('BEGIN IMMEDIATE')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(SQLITE_MIGRATIONS):
+                    conn.execute('COMMIT')
+                    return
+                for statement in SQLITE_MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.execute('COMMIT')
+                print(f"Cart database migrated to schema version {version + 1}")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def items(self, session_id):
+        with self.db.connect() as conn:
+            rows = conn.execute('''
+                SELECT id, session_id, album_id, album_name, artist, price, quantity, cover_url, created_at
+                FROM cart_items
+                WHERE session_id = ?
+                ORDER BY created_at DESC, id DESC
+            ''', (session_id,)).fetchall()
+        return [CartItem(*row) for row in rows]
+
+    def add(self, session_id, album_id, album_name, artist, price, quantity, cover_url):
+        with self.db.connect() as conn:
+            conn.execute('''
+                INSERT INTO cart_items (session_id, album_id, album_name, artist, price, quantity, cover_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (session_id, album_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            ''', (session_id, album_id, album_name, artist, price, quantity, cover_url))
+
+    def set_quantity(self, session_id, item_id, quantity):
+        with self.db.connect() as conn:
+            conn.execute('UPDATE cart_items SET quantity = ? WHERE id = ? AND session_id = ?',
+                         (quantity, item_id, session_id))
+
+    def remove(self, session_id, item_id):
+        with self.db.connect() as conn:
+            conn.execute('DELETE FROM cart_items WHERE id = ? AND session_id = ?', (item_id, session_id))
+
+    def clear(self, session_id):
+        with self.db.connect() as conn:
+            conn.execute('DELETE FROM cart_items WHERE session_id = ?', (session_id,))
+
+    def save_payment(self, payment, if_status=None):
+        with self.db.connect() as conn:
+            cursor = conn.execute('''
+                INSERT INTO cart_payments (id, session_id, status, message, details, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    status = excluded.status, message = excluded.message, details = excluded.details,
+                    updated_at = excluded.updated_at
+                WHERE ? IS NULL OR cart_payments.status = ?
+            ''', (payment.id, payment.session_id, payment.status, payment.message, json.dumps(payment.details),
+                  payment.created_at, payment.updated_at, if_status, if_status))
+            return cursor.rowcount > 0
+
+    def payment(self, payment_id):
+        with self.db.connect() as conn:
+            row = conn.execute('''
+                SELECT id, session_id, status, message, details, created_at, COALESCE(updated_at, created_at)
+                FROM cart_payments WHERE id = ?
+            ''', (payment_id,)).fetchone()
+        return None if row is None else Payment(*row[:4], json.loads(row[4]), *row[5:])
+
+    def prune_payments(self, before):
+        with self.db.connect() as conn:
+            conn.execute('DELETE FROM cart_payments WHERE created_at < ?', (before,))
+
+
+class MemoryCartBackend(CartBackend):
+    """Carts in a dict of this process; nothing survives a restart or is shared between replicas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._carts = {}  # session_id -> {album_id: CartItem}, in the order albums were added
+        self._payments = {}
+        self._next_id = 1
+
+    def items(self, session_id):
+        with self._lock:
+            return list(reversed(self._carts.get(session_id, {}).values()))
+
+    def add(self, session_id, album_id, album_name, artist, price, quantity, cover_url):
+        with self._lock:
+            cart = self._carts.setdefault(session_id, {})
+            item = cart.get(album_id)
+            if item is not None:
+                cart[album_id] = item._replace(quantity=item.quantity + quantity)
+                return
+            cart[album_id] = CartItem(self._next_id, session_id, album_id, album_name, artist, price, quantity,
+                                      cover_url, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+            self._next_id += 1
+
+    def _update(self, session_id, item_id, change):
+        with self._lock:
+            cart = self._carts.get(session_id, {})
+            for album_id, item in list(cart.items()):
+                if item.id == item_id:
+                    change(cart, album_id, item)
+
+    def set_quantity(self, session_id, item_id, quantity):
+        def update(cart, album_id, item):
+            cart[album_id] = item._replace(quantity=quantity)
+        self._update(session_id, item_id, update)
+
+    def remove(self, session_id, item_id):
+        def delete(cart, album_id, item):
+            del cart[album_id]
+        self._update(session_id, item_id, delete)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._carts.pop(session_id, None)
+
+    def save_payment(self, payment, if_status=None):
+        with self._lock:
+            existing = self._payments.get(payment.id)
+            if existing is not None:
+                if if_status is not None and existing.status != if_status:
+                    return False
+                payment = existing._replace(status=payment.status, message=payment.message, details=payment.details,
+                                            updated_at=payment.updated_at)
+            self._payments[payment.id] = payment
+            return True
+
+    def payment(self, payment_id):
+        with self._lock:
+            return self._payments.get(payment_id)
+
+    def prune_payments(self, before):
+        with self._lock:
+            for payment_id in [p.id for p in self._payments.values() if p.created_at < before]:
+                del self._payments[payment_id]
+
+
+class PostgresCartBackend(CartBackend):
+    """Carts in the ``cart_items`` table of a PostgreSQL database shared by all cart replicas.
+
+    ``connect`` opens a psycopg2 connection; connections are pooled with
+    common.pg_pool and queries are timed like the store's.
+    """
+
+    def __init__(self, connect, maxconn=10, timeout=5.0):
+        if psycopg2 is None:
+            raise RuntimeError('CART_BACKEND=postgres requires psycopg2 (pip install psycopg2-binary)')
+        self.pool = ConnectionPool(connect, minconn=1, maxconn=maxconn, timeout=timeout)
+        self._create_schema()
+
+    @staticmethod
+    def connector(**params):
+        """``connect`` argument opening timed psycopg2 connections with ``params``"""
+        return lambda: psycopg2.connect(connection_factory=TimedConnection, **params)
+
+    def _create_schema(self):
+        # Same definition as database-service/init.sql, for databases created before the table existed
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS cart_items (
+                        id SERIAL PRIMARY KEY,
+                        session_id VARCHAR(64) NOT NULL,
+                        album_id INTEGER NOT NULL,
+                        album_name VARCHAR(255) NOT NULL,
+                        artist VARCHAR(255) NOT NULL,
+                        price DOUBLE PRECISION NOT NULL,
+                        quantity INTEGER NOT NULL,
+                        cover_url TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE (session_id, album_id)
+                    )''')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_cart_items_session ON cart_items (session_id, created_at)')
+                cur.execute('''
+                    CREATE TABLE IF NOT EXISTS cart_payments (
+                        id VARCHAR(32) PRIMARY KEY,
+                        session_id VARCHAR(64) NOT NULL,
+                        status VARCHAR(16) NOT NULL,
+                        message TEXT,
+                        details TEXT,
+                        created_at DOUBLE PRECISION NOT NULL,
+                        updated_at DOUBLE PRECISION
+                    )''')
+                cur.execute('ALTER TABLE cart_payments ADD COLUMN IF NOT EXISTS updated_at DOUBLE PRECISION')
+                cur.execute('CREATE INDEX IF NOT EXISTS idx_cart_payments_created_at ON cart_payments (created_at)')
+
+    def items(self, session_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT id, session_id, album_id, album_name, artist, price, quantity, cover_url, created_at
+                    FROM cart_items
+                    WHERE session_id = %s
+                    ORDER BY created_at DESC, id DESC
+                ''', (session_id,))
+                return [CartItem(*row) for row in cur.fetchall()]
+
+    def add(self, session_id, album_id, album_name, artist, price, quantity, cover_url):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO cart_items (session_id, album_id, album_name, artist, price, quantity, cover_url)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (session_id, album_id) DO UPDATE SET quantity = cart_items.quantity + EXCLUDED.quantity
+                ''', (session_id, album_id, album_name, artist, price, quantity, cover_url))
+
+    def set_quantity(self, session_id, item_id, quantity):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('UPDATE cart_items SET quantity = %s WHERE id = %s AND session_id = %s',
+                            (quantity, item_id, session_id))
+
+    def remove(self, session_id, item_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM cart_items WHERE id = %s AND session_id = %s', (item_id, session_id))
+
+    def clear(self, session_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM cart_items WHERE session_id = %s', (session_id,))
+
+    def save_payment(self, payment, if_status=None):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    INSERT INTO cart_payments (id, session_id, status, message, details, created_at, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        status = EXCLUDED.status, message = EXCLUDED.message, details = EXCLUDED.details,
+                        updated_at = EXCLUDED.updated_at
+                    WHERE %s::text IS NULL OR cart_payments.status = %s
+                ''', (payment.id, payment.session_id, payment.status, payment.message, json.dumps(payment.details),
+                      payment.created_at, payment.updated_at, if_status, if_status))
+                return cur.rowcount > 0
+
+    def payment(self, payment_id):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    SELECT id, session_id, status, message, details, created_at, COALESCE(updated_at, created_at)
+                    FROM cart_payments WHERE id = %s
+                ''', (payment_id,))
+                row = cur.fetchone()
+        return None if row is None else Payment(*row[:4], json.loads(row[4]), *row[5:])
+
+    def prune_payments(self, before):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('DELETE FROM cart_payments WHERE created_at < %s', (before,))
@@ -0,0 +1,128 @@
+"""Payment authorization and order placement in background worker threads
+
+The checkout request only records a pending payment and queues it, so a
+slow payment processor no longer holds a request thread. The payment's
+state lives in the cart backend, where the status page polls it. Only the
+job state and the placed order's id and number are stored there; the
+order itself, with the customer's details, is handed to the worker in
+memory and dropped once the job is done.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cart_backends import Payment
+from payments import PaymentError
+from common.metrics import Counter
+from common.tracing import finish_server_span, span, start_server_span
+
+PENDING, PROCESSING, SUCCEEDED, DECLINED, FAILED = 'pending', 'processing', 'succeeded', 'declined', 'failed'
+INTERRUPTED = 'Payment processing was interrupted. Please try again.'
+# Finished payments are kept this long for their status page
+PAYMENT_RETENTION_SECONDS = 24 * 60 * 60
+
+PAYMENTS = Counter('payments_total', 'Finished background payments by outcome', ('status',))
+
+
+class OrderError(Exception):
+    """The order could not be placed; the message is shown to the customer"""
+
+
+class PaymentJobs:
+    """Runs ``authorize(order_data)`` and then ``place_order(order_data)`` for each submitted payment.
+
+    ``authorize`` returns False to decline the payment and raises
+    PaymentError when the provider failed to decide. ``place_order``
+    returns the placed order's ``order_id`` and ``order_number`` (the
+    payment's details once it succeeded), or raises OrderError when the
+    order could not be placed.
+
+    A payment is pending until a worker takes it up and processing until it
+    is decided. One that stays pending or processing for ``stale_after``
+    seconds (the queue was too long, or its worker died with the process)
+    is failed, and a worker never starts a payment that has waited that
+    long, so a payment reported failed is never charged afterwards.
+    """
+
+    def __init__(self, backend, authorize, place_order, workers=16, stale_after=60.0):
+        self.backend = backend
+        self.authorize = authorize
+        self.place_order = place_order
+        self.stale_after = stale_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment')
+
+    def submit(self, session_id, order_data, traceparent=None):
+        """Record a pending payment, queue it and return its id"""
+        now = time.time()
+        payment = Payment(os.urandom(16).hex(), session_id, PENDING, None, {}, now, now)
+        self.backend.save_payment(payment)
+        self.backend.prune_payments(payment.created_at - PAYMENT_RETENTION_SECONDS)
+        self._executor.submit(self._process, payment, order_data, traceparent)
+        return payment.id
+
+    def status(self, payment_id):
+        """The payment, or None if there is no such payment; a stuck payment is failed first"""
+        payment = self.backend.payment(payment_id)
+        if payment is not None and payment.status in (PENDING, PROCESSING) and self._stale(payment):
+            # A worker may take the payment up or finish it meanwhile; then its own state is shown
+            return self._interrupt(payment) or self.backend.payment(payment_id)
+        return payment
+
+    def _stale(self, payment):
+        return time.time() - payment.updated_at > self.stale_after
+
+    def _interrupt(self, payment):
+        """Fail a stuck payment unless its state changed meanwhile; returns the failed payment or None"""
+        failed = payment._replace(status=FAILED, message=INTERRUPTED, updated_at=time.time())
+        if not self.backend.save_payment(failed, if_status=payment.status):
+            return None
+        PAYMENTS.labels(FAILED).inc()
+        return failed
+
+    def _start(self, payment):
+        """Mark the payment processing; None if it must not run because it may already have been reported failed"""
+        if self._stale(payment):
+            self._interrupt(payment)
+            return None
+        processing = payment._replace(status=PROCESSING, updated_at=time.time())
+        return processing if self.backend.save_payment(processing, if_status=PENDING) else None
+
+    def _process(self, payment, order_data, traceparent):
+        # Continues the checkout request's trace as a separate server span
+        job_span, token = start_server_span('cart', 'payment job', traceparent)
+        try:
+            started = self._start(payment)
+            if started is None:
+                print(f"Payment {payment.id} waited too long for a worker and was not started")
+                return
+            payment = started
+            with span('payment authorization'):
+                approved = self.authorize(order_data)
+            if not approved:
+                self._finish(payment, DECLINED, 'Payment declined. Please check your card details and try again.')
+                return
+            with span('order placement'):
+                order = self.place_order(order_data)
+            self._finish(payment, SUCCEEDED, None, {'order_id': order['order_id'],
+                                                    'order_number': order['order_number']})
+        except OrderError as e:
+            self._finish(payment, FAILED, str(e))
+        except PaymentError as e:
+            print(f"Payment {payment.id} failed: {e}")
+            self._finish(payment, FAILED, e.user_message)
+        except Exception as e:
+            print(f"Payment {payment.id} failed: {e}")
+            self._finish(payment, FAILED, 'Payment processing failed. Please try again.')
+        finally:
+            job_span.set('payment.id', payment.id)
+            finish_server_span(job_span, token)
+
+    def _finish(self, payment, status, message, details=None):
+        finished = payment._replace(status=status, message=message, details=details or {}, updated_at=time.time())
+        if not self.backend.save_payment(finished, if_status=PROCESSING):
+            print(f"Payment {payment.id} finished as {status} but was no longer processing (reported as interrupted)")
+            return
+        PAYMENTS.labels(status).inc()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
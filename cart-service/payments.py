@@ -0,0 +1,187 @@
+"""Payment providers that authorize a checkout's card payment
+
+SimulatedPaymentProvider stands in for a card gateway in-process, with
+a configurable latency distribution (fixed, normal or long-tail), decline
+and error rates and a timeout, so checkout can be load-tested against
+realistic gateway behaviour or run without any delay in benchmarks.
+HttpPaymentProvider calls a gateway over HTTP; ``python payments.py``
+serves the simulated provider as such a stand-in gateway (port
+PAYMENT_STANDIN_PORT).
+"""
+import math
+import os
+import random
+import sys
+import time
+from abc import ABC, abstractmethod
+
+import requests
+from flask import Flask, jsonify, request
+
+# Shared helpers live in common/ at the repository root (copied to /common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.http_client import ServiceClient
+from common.metrics import Histogram, init_metrics
+from common.tracing import init_tracing
+
+PAYMENT_LATENCY = os.environ.get('PAYMENT_LATENCY', 'fixed')
+PAYMENT_LATENCY_SECONDS = float(os.environ.get('PAYMENT_LATENCY_SECONDS', '2'))
+PAYMENT_LATENCY_STDDEV = float(os.environ.get('PAYMENT_LATENCY_STDDEV', '0.5'))
+PAYMENT_LATENCY_SIGMA = float(os.environ.get('PAYMENT_LATENCY_SIGMA', '1.0'))
+PAYMENT_DECLINE_RATE = float(os.environ.get('PAYMENT_DECLINE_RATE', '0.03'))
+PAYMENT_ERROR_RATE = float(os.environ.get('PAYMENT_ERROR_RATE', '0'))
+PAYMENT_TIMEOUT = float(os.environ.get('PAYMENT_TIMEOUT', '10'))
+PAYMENT_STANDIN_PORT = int(os.environ.get('PAYMENT_STANDIN_PORT', '5004'))
+
+APPROVED, DECLINED, ERROR, TIMEOUT = 'approved', 'declined', 'error', 'timeout'
+
+PAYMENT_PROVIDER_DURATION = Histogram('payment_provider_duration_seconds',
+                                      'Time the payment provider took to answer an authorization',
+                                      ('provider', 'outcome'),
+                                      buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+
+
+class PaymentError(Exception):
+    """The provider failed to authorize the payment either way; the customer may try again"""
+    user_message = 'The payment provider is unavailable. Please try again.'
+    outcome = ERROR
+
+
+class PaymentTimeout(PaymentError):
+    """The provider did not answer within the provider's timeout"""
+    user_message = 'The payment provider did not respond in time. Please try again.'
+    outcome = TIMEOUT
+
+
+def latency_distribution(kind=PAYMENT_LATENCY, seconds=PAYMENT_LATENCY_SECONDS, stddev=PAYMENT_LATENCY_STDDEV,
+                         sigma=PAYMENT_LATENCY_SIGMA, rng=random):
+    """A function returning one sampled provider latency in seconds.
+
+    ``fixed`` always takes ``seconds``; ``normal`` averages ``seconds`` with
+    standard deviation ``stddev`` (never below zero); ``long_tail`` is
+    log-normal with median ``seconds`` and shape ``sigma``, so most calls
+    are quick and a few are many times slower.
+    """
+    if kind == 'fixed':
+        return lambda: seconds
+    if kind == 'normal':
+        return lambda: max(0.0, rng.gauss(seconds, stddev))
+    if kind == 'long_tail':
+        if seconds <= 0:
+            return lambda: 0.0
+        mu = math.log(seconds)
+        return lambda: rng.lognormvariate(mu, sigma)
+    raise ValueError(f'Unknown PAYMENT_LATENCY {kind!r} (expected fixed, normal or long_tail)')
+
+
+class PaymentProvider(ABC):
+    """Authorizes card payments; ``authorize`` returns True (approved) or False (declined)"""
+
+    name = 'payment'
+    timeout = PAYMENT_TIMEOUT
+
+    def authorize(self, order_data):
+        """Authorize the payment for ``order_data``; raises PaymentError if the provider failed"""
+        start = time.perf_counter()
+        outcome = ERROR
+        try:
+            approved = self._authorize(order_data)
+            outcome = APPROVED if approved else DECLINED
+            return approved
+        except PaymentError as e:
+            outcome = e.outcome
+            raise
+        finally:
+            PAYMENT_PROVIDER_DURATION.labels(self.name, outcome).observe(time.perf_counter() - start)
+
+    @abstractmethod
+    def _authorize(self, order_data):
+        """Approve (True) or decline (False) the payment; raise PaymentError if the provider failed"""
+
+
+class SimulatedPaymentProvider(PaymentProvider):
+    """A card gateway simulated in-process.
+
+    Every call waits a latency drawn from ``latency``, then declines
+    ``decline_rate`` and fails ``error_rate`` of the payments. A call whose
+    latency exceeds ``timeout`` gives up after ``timeout`` seconds with
+    PaymentTimeout.
+    """
+
+    name = 'simulated'
+
+    def __init__(self, latency=None, decline_rate=PAYMENT_DECLINE_RATE, error_rate=PAYMENT_ERROR_RATE,
+                 timeout=PAYMENT_TIMEOUT, rng=random):
+        self.latency = latency or latency_distribution(rng=rng)
+        self.decline_rate = decline_rate
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self.rng = rng
+
+    def _authorize(self, order_data):
+        latency = self.latency()
+        if self.timeout is not None and latency > self.timeout:
+            time.sleep(self.timeout)
+            raise PaymentTimeout(f'Simulated payment provider took longer than {self.timeout}s')
+        time.sleep(latency)
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            raise PaymentError('Simulated payment provider error')
+        return roll >= self.error_rate + self.decline_rate
+
+
+class HttpPaymentProvider(PaymentProvider):
+    """A card gateway reached over HTTP, such as the stand-in served by ``python payments.py``.
+
+    ``POST /authorize`` gets the session id and order total and answers
+    ``{"approved": true|false}``; any other answer, a connection error or
+    no answer within ``timeout`` is a PaymentError. Payments are never
+    retried, so a slow gateway cannot authorize the same payment twice.
+    """
+
+    name = 'http'
+
+    def __init__(self, base_url, timeout=PAYMENT_TIMEOUT):
+        self.timeout = timeout
+        self.client = ServiceClient('payment', base_url, timeout=timeout, max_retries=0)
+
+    def _authorize(self, order_data):
+        try:
+            response = self.client.post('/authorize', json={'session_id': order_data['session_id'],
+                                                            'amount': order_data['total']})
+        except requests.Timeout as e:
+            raise PaymentTimeout(f'Payment provider timed out: {e}') from e
+        except requests.RequestException as e:
+            raise PaymentError(f'Payment provider unavailable: {e}') from e
+        if response.status_code != 200:
+            raise PaymentError(f'Payment provider answered {response.status_code}')
+        return bool(response.json().get('approved'))
+
+
+def create_standin_app(provider):
+    """Flask app serving ``provider`` as an HTTP payment gateway for HttpPaymentProvider"""
+    app = Flask(__name__)
+    init_metrics(app)
+    init_tracing(app, 'payment')
+
+    @app.route('/authorize', methods=['POST'])
+    def authorize():
+        """Authorize a payment after the simulated gateway latency"""
+        try:
+            approved = provider.authorize(request.get_json())
+        except PaymentError as e:
+            return jsonify({'error': str(e)}), 503
+        return jsonify({'approved': approved})
+
+    @app.route('/health')
+    def health():
+        """Health check endpoint"""
+        return jsonify({'status': 'healthy', 'service': 'payment-standin'})
+
+    return app
+
+
+if __name__ == '__main__':
+    # The stand-in answers late rather than timing out itself; callers apply their own timeout
+    standin = create_standin_app(SimulatedPaymentProvider(timeout=None))
+    standin.run(host='0.0.0.0', port=PAYMENT_STANDIN_PORT, threaded=True)
@@ -0,0 +1,246 @@
+"""In-process cache of the album catalog with write-through updates"""
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+
+import psycopg2.extras
+
+VERSION_QUERY = 'SELECT COUNT(*) AS album_count, MAX(updated_at) AS last_updated FROM albums'
+
+# Sort name -> (column, direction, cursor value parser). Every sort breaks ties on id,
+# and each (column, id) pair is backed by an index (created at startup by SCHEMA_MIGRATIONS in app.py).
+SORTS = {
+    'newest': ('created_at', 'DESC', datetime.fromisoformat),
+    'oldest': ('created_at', 'ASC', datetime.fromisoformat),
+    'price_asc': ('price', 'ASC', Decimal),
+    'price_desc': ('price', 'DESC', Decimal),
+    'name': ('name', 'ASC', str),
+}
+DEFAULT_SORT = 'newest'
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(sort, album):
+    """Opaque cursor pointing just past ``album`` in ``sort`` order"""
+    column = SORTS[sort][0]
+    value = album[column]
+    value = value.isoformat() if isinstance(value, datetime) else str(value)
+    raw = json.dumps([sort, value, album['id']], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(sort, cursor):
+    """Return the (value, id) keyset position encoded in ``cursor``"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, value, album_id = json.loads(raw)
+        if cursor_sort != sort:
+            raise InvalidCursor('Cursor was issued for sort %r' % cursor_sort)
+        return SORTS[sort][2](value), int(album_id)
+    except InvalidCursor:
+        raise
+    except (ValueError, TypeError, ArithmeticError) as e:
+        raise InvalidCursor('Malformed cursor') from e
+
+
+class CatalogCache:
+    """Serves the album list, by-id lookups and keyset pages from memory.
+
+    The cache is keyed on a catalog version made of the row count and
+    ``MAX(updated_at)`` (maintained by the ``update_albums_updated_at``
+    trigger), so replicas that did not perform a write notice it the next
+    time they revalidate. Writes made through this process are applied to
+    the cached copy directly.
+    """
+
+    def __init__(self, get_connection, revalidate_interval=5.0, max_pages=256):
+        self._get_connection = get_connection
+        self.revalidate_interval = revalidate_interval
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        # (version, albums newest first, albums by id), loaded on first full-list read
+        self._albums = None
+        # (sort, cursor, limit) -> (albums, next_cursor) for the current version
+        self._pages = OrderedDict()
+
+    # --- Reads ---
+
+    @property
+    def version(self):
+        """Current catalog version as (album count, last updated_at)"""
+        version = self._version
+        if version is not None and time.monotonic() - self._checked_at < self.revalidate_interval:
+            return version
+        with self._lock:
+            if self._version is None or time.monotonic() - self._checked_at >= self.revalidate_interval:
+                with self._get_connection() as conn:
+                    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                        self._set_version(self._read_version(cur))
+            return self._version
+
+    def albums(self):
+        """All albums, newest first"""
+        return self._full()[1]
+
+    def get(self, album_id):
+        """Album by id, or None"""
+        try:
+            album_id = int(album_id)
+        except (TypeError, ValueError):
+            return None
+        return self._full()[2].get(album_id)
+
+    def page(self, sort=DEFAULT_SORT, cursor=None, limit=24):
+        """One page of albums in ``sort`` order starting after ``cursor``.
+
+        Returns ``(albums, next_cursor)``; ``next_cursor`` is None on the last
+        page. Pages are fetched with keyset queries on ``(column, id)`` so
+        their cost does not depend on how deep into the catalog they are.
+        """
+        if sort not in SORTS:
+            raise ValueError('Unknown sort %r' % sort)
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        position = decode_cursor(sort, cursor) if cursor else None
+
+        version = self.version
+        key = (sort, cursor, limit)
+        with self._lock:
+            if self._version == version and key in self._pages:
+                self._pages.move_to_end(key)
+                return self._pages[key]
+
+        column, direction, _ = SORTS[sort]
+        query = 'SELECT * FROM albums'
+        params = []
+        if position is not None:
+            query += ' WHERE (%s, id) %s (%%s, %%s)' % (column, '<' if direction == 'DESC' else '>')
+            params.extend(position)
+        query += ' ORDER BY %s %s, id %s LIMIT %%s' % (column, direction, direction)
+        params.append(limit + 1)
+
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute(query, params)
+                rows = cur.fetchall()
+        albums = rows[:limit]
+        next_cursor = encode_cursor(sort, albums[-1]) if len(rows) > limit else None
+        result = (albums, next_cursor)
+
+        with self._lock:
+            if self._version == version:
+                self._pages[key] = result
+                while len(self._pages) > self.max_pages:
+                    self._pages.popitem(last=False)
+        return result
+
+    # --- Writes ---
+
+    def add_album(self, name, artist, price, cover_url, cover_color=None, cover_placeholder=None):
+        """Insert an album and apply it to the cached catalog"""
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                before = self._read_version(cur)
+                cur.execute('''INSERT INTO albums (name, artist, price, cover_url, cover_color, cover_placeholder)
+                               VALUES (%s, %s, %s, %s, %s, %s) RETURNING *''',
+                            (name, artist, price, cover_url, cover_color, cover_placeholder))
+                album = cur.fetchone()
+                after = self._read_version(cur)
+            conn.commit()
+        self._write_through(before, after, lambda albums: [album] + albums)
+        return album
+
+    def update_cover(self, album_id, old_url, cover_url, cover_color=None, cover_placeholder=None):
+        """Point an album at a new cover if it still uses ``old_url``; returns the updated album or None"""
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                before = self._read_version(cur)
+                cur.execute('''UPDATE albums SET cover_url = %s, cover_color = %s, cover_placeholder = %s
+                               WHERE id = %s AND cover_url = %s RETURNING *''',
+                            (cover_url, cover_color, cover_placeholder, album_id, old_url))
+                album = cur.fetchone()
+                after = self._read_version(cur)
+            conn.commit()
+        if album is not None:
+            self._write_through(before, after,
+                                lambda albums: [album if a['id'] == album_id else a for a in albums])
+        return album
+
+    def delete_album(self, album_id):
+        """Delete an album and drop it from the cached catalog"""
+        with self._get_connection() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                before = self._read_version(cur)
+                cur.execute('DELETE FROM albums WHERE id = %s', (album_id,))
+                after = self._read_version(cur)
+            conn.commit()
+        self._write_through(before, after, lambda albums: [a for a in albums if a['id'] != album_id])
+
+    def invalidate(self):
+        """Force a reload on the next read"""
+        with self._lock:
+            self._version = None
+            self._albums = None
+            self._pages.clear()
+
+    # --- Internals ---
+
+    def _full(self):
+        """The full album list for the current version, loading it if needed"""
+        version = self.version
+        state = self._albums
+        if state is not None and state[0] == version:
+            return state
+        with self._lock:
+            state = self._albums
+            if state is None or state[0] != self._version:
+                with self._get_connection() as conn:
+                    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                        version = self._read_version(cur)
+                        cur.execute('SELECT * FROM albums ORDER BY created_at DESC, id DESC')
+                        state = self._build_state(version, cur.fetchall())
+                self._set_version(version)
+                self._albums = state
+            return state
+
+    def _set_version(self, version):
+        """Record a freshly read version (lock held)"""
+        if version != self._version:
+            self._pages.clear()
+        self._version = version
+        self._checked_at = time.monotonic()
+
+    def _write_through(self, before, after, apply):
+        """Apply a local write if the cache was current when it happened, else invalidate"""
+        with self._lock:
+            if self._version != before:
+                self._version = None
+                self._albums = None
+                self._pages.clear()
+                return
+            state = self._albums
+            if state is not None and state[0] == before:
+                self._albums = self._build_state(after, apply(list(state[1])))
+            else:
+                self._albums = None
+            self._set_version(after)
+
+    @staticmethod
+    def _build_state(version, albums):
+        albums = sorted(albums, key=lambda a: (a['created_at'], a['id']), reverse=True)
+        return (version, albums, {a['id']: a for a in albums})
+
+    @staticmethod
+    def _read_version(cur):
+        cur.execute(VERSION_QUERY)
+        row = cur.fetchone()
+        return (row['album_count'], row['last_updated'])
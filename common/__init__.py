@@ -0,0 +1 @@
+"""Helpers shared by the music store services"""
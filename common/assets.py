@@ -0,0 +1,137 @@
+"""Content-hashed static bundles built when a service starts"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+
+from flask import request, send_from_directory
+
+from common.compression import available_encodings, compress, is_compressible, negotiate
+
+# Assets every service ships (the stylesheet of the self-hosted Inter font)
+COMMON_ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+# Files that need not be present (the Inter font is not in the repository); references to them are dropped
+OPTIONAL_ASSETS = {'fonts/InterVariable.woff2'}
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+# File suffix of the precompressed copy for each content coding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+CSS_URL_RE = re.compile(r'''url\((["']?)([^)"']+)\1\)''')
+# One url() source of a @font-face src list, with its format() hint and separating comma
+CSS_FONT_SOURCE_RE = re.compile(r''',?\s*url\((["']?)([^)"']+)\1\)\s*format\([^)]*\)''')
+
+mimetypes.add_type('font/woff2', '.woff2')
+
+
+def hashed_name(path, content):
+    """``css/site.css`` -> ``css/site.<first 12 hex digits of sha256>.css``"""
+    root, ext = posixpath.splitext(path)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_css_urls(path, css, manifest):
+    """Point relative url() references in the stylesheet at ``path`` to their hashed names.
+
+    Font sources naming a missing optional asset are removed, so browsers
+    fall back to the next source instead of requesting a file that 404s.
+    """
+    def resolve(ref):
+        return posixpath.normpath(posixpath.join(posixpath.dirname(path), ref))
+
+    def drop_missing_font(match):
+        target = resolve(match.group(2))
+        return '' if target in OPTIONAL_ASSETS and target not in manifest else match.group(0)
+
+    def replace(match):
+        quote, ref = match.groups()
+        if ref.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+        target = resolve(ref)
+        if target not in manifest:
+            print(f"Asset {path} references missing file {target}")
+            return match.group(0)
+        return f'url({quote}{posixpath.relpath(manifest[target], posixpath.dirname(path))}{quote})'
+    return CSS_URL_RE.sub(replace, CSS_FONT_SOURCE_RE.sub(drop_missing_font, css))
+
+
+def _write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def build_assets(source_dirs, build_dir):
+    """Copy every file in ``source_dirs`` into ``build_dir`` under a content-hashed name.
+
+    Files in later directories override files with the same relative
+    path in earlier ones. Returns the manifest ({path: hashed path}),
+    which is also written to ``build_dir/manifest.json``.
+    """
+    sources = {}
+    for source_dir in source_dirs:
+        for dirpath, _, filenames in os.walk(source_dir):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                sources[os.path.relpath(full_path, source_dir).replace(os.sep, '/')] = full_path
+
+    manifest = {}
+    # Stylesheets go last so the fonts and images they reference already have hashed names
+    for path in sorted(sources, key=lambda p: (p.endswith('.css'), p)):
+        with open(sources[path], 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = _rewrite_css_urls(path, content.decode('utf-8'), manifest).encode('utf-8')
+        manifest[path] = hashed_name(path, content)
+        target = os.path.join(build_dir, manifest[path])
+        if not os.path.exists(target):
+            _write_atomic(target, content)
+        # Precompressed once here so requests never compress assets
+        if is_compressible(mimetypes.guess_type(path)[0]):
+            for encoding in available_encodings():
+                if not os.path.exists(target + ENCODING_SUFFIXES[encoding]):
+                    _write_atomic(target + ENCODING_SUFFIXES[encoding], compress(content, encoding))
+
+    _write_atomic(os.path.join(build_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def register_assets(app, service, source_dir, build_dir=None):
+    """Build the service's assets and serve them at ``/assets/<service>/``.
+
+    Templates link to them with ``{{ asset_url('css/page.css') }}``, which
+    resolves to the content-hashed URL, so the files can be cached by
+    browsers forever and a changed file is simply fetched under its new
+    name. The built files go to ``ASSET_BUILD_DIR`` (one directory per
+    service). Returns the manifest.
+    """
+    if build_dir is None:
+        build_dir = os.path.join(
+            os.environ.get('ASSET_BUILD_DIR', os.path.join(tempfile.gettempdir(), 'asset-build')),
+            service)
+    manifest = build_assets([COMMON_ASSETS_DIR, source_dir], build_dir)
+    url_prefix = f'/assets/{service}'
+
+    def asset_url(path):
+        return f'{url_prefix}/{manifest[path]}'
+
+    def serve_asset(filename):
+        encoding = negotiate(request)
+        encoded = filename + ENCODING_SUFFIXES[encoding] if encoding else None
+        if encoded and os.path.exists(os.path.join(build_dir, encoded)):
+            response = send_from_directory(build_dir, encoded, max_age=ASSET_MAX_AGE,
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(build_dir, filename, max_age=ASSET_MAX_AGE)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.add_url_rule(f'{url_prefix}/<path:filename>', 'serve_asset', serve_asset)
+    return manifest
@@ -0,0 +1,142 @@
+"""Negotiated gzip/brotli response compression and template minification"""
+import gzip
+import os
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def available_encodings():
+    """Content codings this process can produce, best first"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(request):
+    """The coding to use for ``request`` based on its Accept-Encoding, or None"""
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+class Compressor:
+    """Compresses eligible responses of a Flask app after each request.
+
+    A response is compressed when the client accepts gzip or br, the body
+    is a buffered text-like payload of at least ``min_size`` bytes and it
+    has no Content-Encoding yet. Streamed and passthrough responses (the
+    proxied cart pages, files) are left alone. Compressed bodies of
+    responses that carry an ETag are kept in an LRU keyed by
+    (ETag, coding), so a cacheable page is compressed once per version.
+    """
+
+    def __init__(self, app=None, min_size=1024, cache_entries=256):
+        self.min_size = min_size
+        self.cache_entries = cache_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from flask import request
+
+        @app.after_request
+        def compress_response(response):
+            return self.process(request, response)
+
+    def process(self, request, response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request)
+        if encoding is None or response.calculate_content_length() < self.min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        body = self._cached(etag, encoding) if etag else None
+        if body is None:
+            body = compress(response.get_data(), encoding)
+            if etag:
+                self._store(etag, encoding, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # A compressed body is a different representation of the same resource
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _cached(self, etag, encoding):
+        with self._lock:
+            body = self._cache.get((etag, encoding))
+            if body is not None:
+                self._cache.move_to_end((etag, encoding))
+                self.hits += 1
+            else:
+                self.misses += 1
+            return body
+
+    def _store(self, etag, encoding, body):
+        with self._lock:
+            self._cache[(etag, encoding)] = body
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._cache), 'hits': self.hits, 'misses': self.misses,
+                    'encodings': list(available_encodings())}
+
+
+def init_compression(app):
+    """Enable response compression on ``app`` using the COMPRESS_* settings from the environment"""
+    return Compressor(app,
+                      min_size=int(os.environ.get('COMPRESS_MIN_SIZE', '1024')),
+                      cache_entries=int(os.environ.get('COMPRESS_CACHE_ENTRIES', '256')))
+
+
+_PRESERVE_RE = re.compile(r'(<(pre|textarea)\b.*?</\2>)', re.S | re.I)
+_COMMENT_RE = re.compile(r'<!--(?!\[if).*?-->', re.S)
+_INDENT_RE = re.compile(r'\n[ \t]*')
+
+
+def minify_html(source):
+    """Drop HTML comments, indentation and blank lines outside <pre>/<textarea>.
+
+    Line breaks are kept (collapsed to one), so whitespace between inline
+    elements and statement boundaries in inline scripts are unaffected.
+    """
+    parts = _PRESERVE_RE.split(source)
+    out = []
+    # re.split yields [text, preserved block, tag name, text, ...]
+    for i in range(0, len(parts), 3):
+        text = _COMMENT_RE.sub('', parts[i])
+        out.append(re.sub(r'\n+', '\n', _INDENT_RE.sub('\n', text)))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return ''.join(out).strip() + '\n'
@@ -0,0 +1,110 @@
+"""End-to-end request deadlines propagated between the services
+
+The first service a request reaches gives it ``REQUEST_DEADLINE_MS`` to
+finish. Downstream calls carry the time that is left in the
+``X-Request-Deadline-Ms`` header (a relative budget, so clocks need not
+agree) and each service continues with that budget instead of starting
+its own. The header can also come from outside clients, so it may only
+shorten the budget, never extend it past ``REQUEST_DEADLINE_MS``. Work that would outlive the deadline is refused with a 504
+instead of being done for a client that has stopped waiting.
+"""
+import math
+import os
+import time
+from contextvars import ContextVar
+
+from common.metrics import Counter
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+REQUEST_DEADLINE_MS = float(os.environ.get('REQUEST_DEADLINE_MS', '15000'))
+
+_deadline = ContextVar('deadline', default=None)
+
+DEADLINE_EXCEEDED = Counter('deadline_exceeded_total', 'Work refused because the request deadline had passed',
+                            ('operation',))
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed, or too little of it is left for the next step"""
+
+    def __init__(self, operation):
+        super().__init__(f'Deadline exceeded before {operation}')
+        self.operation = operation
+        DEADLINE_EXCEEDED.labels(operation).inc()
+
+
+def parse_budget(value):
+    """Seconds left according to a deadline header value, or None if it is missing or malformed"""
+    try:
+        budget = float(value) / 1000
+    except (TypeError, ValueError):
+        return None
+    return budget if math.isfinite(budget) else None
+
+
+def request_budget(value, default_ms=REQUEST_DEADLINE_MS):
+    """Seconds an incoming request may take: the header's budget, capped at ``default_ms``"""
+    budget = parse_budget(value)
+    default = default_ms / 1000
+    return default if budget is None else min(budget, default)
+
+
+def start(budget):
+    """Make the current request due ``budget`` seconds from now; returns a token for ``finish``"""
+    return _deadline.set(time.monotonic() + budget)
+
+
+def finish(token):
+    try:
+        _deadline.reset(token)
+    except ValueError:
+        # Finished in a different context than it was started in
+        _deadline.set(None)
+
+
+def remaining():
+    """Seconds until the current request's deadline, or None outside a request that has one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(operation, needed=0.0):
+    """Raise DeadlineExceeded unless at least ``needed`` seconds of the budget are left"""
+    left = remaining()
+    if left is not None and left <= needed:
+        raise DeadlineExceeded(operation)
+
+
+def bounded_timeout(timeout):
+    """``timeout`` shortened to the time left before the deadline (but never to zero)"""
+    left = remaining()
+    return timeout if left is None else max(0.001, min(timeout, left))
+
+
+def header_value():
+    """The budget to hand a downstream call, or None if the request has no deadline"""
+    left = remaining()
+    return None if left is None else str(max(0, int(left * 1000)))
+
+
+def init_deadlines(app, default_ms=REQUEST_DEADLINE_MS):
+    """Give every request of ``app`` a deadline and answer 504 once it has passed"""
+    from flask import g, request
+
+    @app.before_request
+    def start_deadline():
+        budget = request_budget(request.headers.get(DEADLINE_HEADER), default_ms)
+        g.deadline_token = start(budget)
+        if budget <= 0:
+            # The caller has already given up on this request
+            raise DeadlineExceeded('handling the request')
+
+    @app.teardown_request
+    def finish_deadline(exc):
+        token = g.pop('deadline_token', None)
+        if token is not None:
+            finish(token)
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(e):
+        return str(e), 504
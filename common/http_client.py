@@ -0,0 +1,185 @@
+"""Pooled keep-alive HTTP clients for calls between the services"""
+import random
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from flask import Response
+from requests.adapters import HTTPAdapter
+
+from common import deadlines
+from common.metrics import DOWNSTREAM_DURATION
+from common.resilience import RETRIES, CircuitBreaker, CircuitOpenError, RetryBudget
+from common.tracing import start_span
+
+# Request headers relayed to the downstream service when proxying a page
+PASSTHROUGH_REQUEST_HEADERS = ('Accept', 'Accept-Encoding', 'Accept-Language', 'If-None-Match', 'If-Modified-Since')
+# Response headers relayed back to the client
+PASSTHROUGH_RESPONSE_HEADERS = ('Content-Type', 'Content-Encoding', 'Content-Length', 'Cache-Control',
+                                'ETag', 'Last-Modified', 'Expires', 'Vary', 'Location')
+STREAM_CHUNK_SIZE = 16 * 1024
+# Only these methods are retried unless a call passes retry=True
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# Responses that mean the dependency is unhealthy rather than that the request was wrong
+FAILURE_STATUSES = {500, 502, 503, 504}
+
+
+class ServiceClient:
+    """HTTP client for one downstream service.
+
+    Wraps a ``requests.Session`` whose connection pool is reused across
+    requests and threads, so calls to the same service share keep-alive
+    connections instead of opening a new TCP connection each time. Paths
+    are relative to ``base_url`` and every call gets the service's default
+    ``timeout`` unless one is passed explicitly.
+
+    Calls go through the service's CircuitBreaker, so an unhealthy
+    dependency fails fast with CircuitOpenError. Idempotent calls (or
+    calls made with ``retry=True``) that fail to connect, time out or get
+    a 5xx response are retried up to ``max_retries`` times with jittered
+    exponential backoff, as long as the RetryBudget allows.
+
+    Inside a request with a deadline each attempt forwards the remaining
+    budget, its timeouts are shortened to fit it and no attempt starts
+    once it has passed.
+    """
+
+    def __init__(self, name, base_url, timeout=5.0, connect_timeout=2.0, pool_size=10,
+                 max_retries=2, retry_backoff=0.05, breaker=None, retry_budget=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker or CircuitBreaker(name)
+        self.retry_budget = retry_budget or RetryBudget()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # The session is shared by every user of this process, so it must never
+        # remember cookies set by a downstream response
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    def url(self, path):
+        return self.base_url + path
+
+    def request(self, method, path, retry=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                response = self._send(method, path, kwargs)
+                if response.status_code not in FAILURE_STATUSES or not self._may_retry(retry, attempt):
+                    return response
+                response.close()
+            except CircuitOpenError:
+                raise
+            except requests.RequestException:
+                if not self._may_retry(retry, attempt):
+                    raise
+            attempt += 1
+            RETRIES.labels(self.name).inc()
+            # Full jitter keeps retries from many callers from arriving in lockstep
+            time.sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+
+    def _may_retry(self, retry, attempt):
+        if not retry or attempt >= self.max_retries:
+            return False
+        left = deadlines.remaining()
+        if left is not None and left <= self.retry_backoff * 2 ** (attempt + 1):
+            return False
+        return self.retry_budget.try_withdraw()
+
+    def _send(self, method, path, kwargs):
+        """One attempt: deadline and breaker checks, the HTTP call, and its metrics and span"""
+        deadline_budget = deadlines.header_value()
+        if deadline_budget is not None:
+            deadlines.check_deadline(f'calling the {self.name} service')
+            headers = dict(kwargs.get('headers') or {})
+            headers[deadlines.DEADLINE_HEADER] = deadline_budget
+            kwargs = dict(kwargs, headers=headers, timeout=self._bounded_timeout(kwargs['timeout']))
+        self.breaker.before_call()
+        span = start_span(f'{method} {self.name}{path}', 'client', **{'peer.service': self.name})
+        if span is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, traceparent=span.traceparent)
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, self.url(path), **kwargs)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            status = response.status_code
+            if status in FAILURE_STATUSES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            DOWNSTREAM_DURATION.labels(self.name, method, status).observe(elapsed)
+            if span is not None:
+                span.set('http.status_code', status)
+                span.end(elapsed)
+
+    @staticmethod
+    def _bounded_timeout(timeout):
+        if isinstance(timeout, tuple):
+            return tuple(None if t is None else deadlines.bounded_timeout(t) for t in timeout)
+        return None if timeout is None else deadlines.bounded_timeout(timeout)
+
+    def stats(self):
+        connect_timeout, read_timeout = self.timeout
+        return {'base_url': self.base_url, 'connect_timeout': connect_timeout, 'read_timeout': read_timeout,
+                'max_retries': self.max_retries, 'circuit': self.breaker.stats()}
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+def passthrough_headers(request):
+    """Headers of the incoming ``request`` that should be relayed downstream.
+
+    Accept-Encoding is always sent (``identity`` if the client gave none) so
+    the downstream body can be relayed without being decoded.
+    """
+    headers = {name: request.headers[name] for name in PASSTHROUGH_REQUEST_HEADERS if name in request.headers}
+    headers.setdefault('Accept-Encoding', 'identity')
+    return headers
+
+
+def stream_response(upstream, chunk_size=STREAM_CHUNK_SIZE):
+    """Relay a downstream response requested with ``stream=True`` chunk by chunk.
+
+    The body is forwarded as received (still content-encoded), and each chunk
+    is only read from the downstream socket once the previous one has been
+    written to the client, so a slow client slows the downstream read instead
+    of being buffered in memory.
+    """
+    def generate():
+        try:
+            for chunk in upstream.raw.stream(chunk_size, decode_content=False):
+                yield chunk
+        finally:
+            upstream.close()
+
+    headers = [(name, upstream.headers[name]) for name in PASSTHROUGH_RESPONSE_HEADERS if name in upstream.headers]
+    return Response(generate(), status=upstream.status_code, headers=headers, direct_passthrough=True)
@@ -0,0 +1,265 @@
+"""In-process Prometheus metrics and the /metrics endpoint shared by the services
+
+Every update is a dict lookup plus a short critical section, so the
+instrumentation is cheap enough to leave on in production. The registry
+is per process; scrape each worker separately.
+"""
+import bisect
+import sqlite3
+import threading
+import time
+
+from flask import Response, g, request
+
+from common.tracing import record_query
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SQL_OPERATIONS = {'select', 'insert', 'update', 'delete', 'with', 'create', 'alter', 'pragma', 'begin', 'commit'}
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _Value:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def samples(self):
+        for key, child in self._items():
+            yield self.name, _format_labels(self.labelnames, key), child.value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+
+class CallbackGauge(_Metric):
+    """Gauge read from ``callback()`` at scrape time; it returns {label values tuple: value}"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames, callback, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.callback = callback
+
+    def samples(self):
+        for key, value in self.callback().items():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class _HistogramValue:
+    __slots__ = ('_lock', 'upper_bounds', 'counts', 'sum')
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self.upper_bounds = upper_bounds
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def samples(self):
+        for key, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))]), cumulative)
+            yield self.name + '_count', _format_labels(self.labelnames, key), cumulative
+            yield self.name + '_sum', _format_labels(self.labelnames, key), total
+
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Time spent handling HTTP requests',
+                             ('method', 'route', 'status'))
+REQUESTS_IN_PROGRESS = Gauge('http_requests_in_progress', 'HTTP requests currently being handled',
+                             ('method', 'route'))
+DOWNSTREAM_DURATION = Histogram('downstream_request_duration_seconds',
+                                'Time until a downstream service responded (headers received)',
+                                ('service', 'method', 'status'))
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'Time spent executing database queries',
+                              ('system', 'operation'), buckets=DB_BUCKETS)
+
+
+def sql_operation(sql):
+    """Low-cardinality label for a statement: its leading keyword"""
+    keyword = sql.lstrip()[:8].split(None, 1)[0].lower() if sql.strip() else ''
+    return keyword if keyword in SQL_OPERATIONS else 'other'
+
+
+def observe_query(system, sql, seconds):
+    DB_QUERY_DURATION.labels(system, sql_operation(sql)).observe(seconds)
+    record_query(system, sql, seconds)
+
+
+def init_metrics(app):
+    """Time every request of ``app`` and serve the registry at /metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.metrics_start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.labels(request.method, g.metrics_route).inc()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            REQUEST_DURATION.labels(request.method, g.metrics_route, response.status_code).observe(
+                time.perf_counter() - start)
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        route = g.pop('metrics_route', None)
+        if route is None:
+            return
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            # The view raised, so after_request never saw a response
+            REQUEST_DURATION.labels(request.method, route, 500).observe(time.perf_counter() - start)
+        REQUESTS_IN_PROGRESS.labels(request.method, route).dec()
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
+class TimedSqliteCursor(sqlite3.Cursor):
+    """sqlite3 cursor recording each execute, and the row fetching SQLite does lazily, as query time"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            observe_query('sqlite', sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            observe_query('sqlite', sql, time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            DB_QUERY_DURATION.labels('sqlite', 'fetch').observe(time.perf_counter() - start)
+
+
+class TimedSqliteConnection(sqlite3.Connection):
+    """Pass as ``sqlite3.connect(path, factory=TimedSqliteConnection)`` to time its queries"""
+
+    def cursor(self, factory=TimedSqliteCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
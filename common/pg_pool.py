@@ -0,0 +1,305 @@
+"""Thread-safe PostgreSQL connection pool with health checks and statistics"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from common.metrics import observe_query
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout"""
+
+
+class _PooledConnection:
+    """Book-keeping for a single physical connection"""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+_timed_cursor_classes = {}
+
+
+def _timed_cursor_class(base):
+    """Subclass of the cursor class ``base`` that records query timings"""
+    cls = _timed_cursor_classes.get(base)
+    if cls is None:
+        def execute(self, query, vars=None):
+            start = time.perf_counter()
+            try:
+                return base.execute(self, query, vars)
+            finally:
+                observe_query('postgresql', query if isinstance(query, str) else str(query), time.perf_counter() - start)
+
+        def executemany(self, query, vars_list):
+            start = time.perf_counter()
+            try:
+                return base.executemany(self, query, vars_list)
+            finally:
+                observe_query('postgresql', query if isinstance(query, str) else str(query), time.perf_counter() - start)
+
+        cls = _timed_cursor_classes.setdefault(
+            base, type('Timed' + base.__name__, (base,), {'execute': execute, 'executemany': executemany}))
+    return cls
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """psycopg2 connection whose cursors, whatever their cursor_factory, record query timings.
+
+    Pass as ``psycopg2.connect(..., connection_factory=TimedConnection)``.
+    """
+
+    def cursor(self, *args, **kwargs):
+        if len(args) > 1:
+            args = list(args)
+            args[1] = _timed_cursor_class(args[1] or self.cursor_factory or psycopg2.extensions.cursor)
+        else:
+            kwargs['cursor_factory'] = _timed_cursor_class(
+                kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections.
+
+    Connections are opened lazily up to ``maxconn``. Callers that find the
+    pool exhausted wait up to ``timeout`` seconds for a connection to be
+    returned. Idle connections are pinged before reuse once they have been
+    idle for ``check_interval`` seconds, and are recycled after
+    ``max_lifetime`` seconds or when idle for longer than ``max_idle``
+    (while more than ``minconn`` are open).
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_interval=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (minconn, maxconn))
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0  # open connections plus slots reserved for connects in progress
+        self._filled = False
+
+        # Statistics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._check_failures = 0
+
+    # --- Checkout / return ---
+
+    def getconn(self, timeout=None):
+        """Check a connection out of the pool, waiting at most ``timeout`` (default: the pool's)"""
+        if timeout is None:
+            timeout = self.timeout
+        if not self._filled:
+            self._fill()
+
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        entry = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    # LIFO keeps the warmest connections in use
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        'No database connection available within %.1fs (pool size %d)'
+                        % (timeout, self.maxconn))
+                waited = True
+                self._cond.wait(remaining)
+
+            wait_time = time.monotonic() - start
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_time_total += wait_time
+            self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        try:
+            if entry is None:
+                entry = _PooledConnection(self._connect())
+            else:
+                entry = self._validate(entry)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use[id(entry.conn)] = entry
+        return entry.conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is unusable"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            raise ValueError('Connection does not belong to this pool')
+
+        now = time.monotonic()
+        if not discard:
+            discard = self._is_broken(conn) or now - entry.created_at > self.max_lifetime
+        if not discard and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard:
+            self._close(conn)
+        entry.last_used = now
+
+        with self._cond:
+            if discard:
+                self._size -= 1
+                self._recycled += 1
+            else:
+                self._idle.append(entry)
+            self._prune_idle(now)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection, committing on success and rolling back on error"""
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception as e:
+            discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def closeall(self):
+        """Close every idle connection and forget about checked-out ones"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._filled = False
+        for entry in idle:
+            self._close(entry.conn)
+
+    def stats(self):
+        """Return a snapshot of pool usage"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 3),
+                'wait_time_avg_ms': round(self._wait_time_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 3),
+                'recycled': self._recycled,
+                'health_check_failures': self._check_failures,
+            }
+
+    # --- Internals ---
+
+    def _fill(self):
+        """Open the minimum number of connections on first use"""
+        with self._cond:
+            if self._filled:
+                return
+            self._filled = True
+            missing = max(0, self.minconn - self._size)
+            self._size += missing
+
+        opened = []
+        try:
+            for _ in range(missing):
+                opened.append(_PooledConnection(self._connect()))
+        except psycopg2.Error:
+            # Leave the remaining slots to be opened on demand
+            pass
+        with self._cond:
+            self._size -= missing - len(opened)
+            self._idle.extend(opened)
+            self._cond.notify_all()
+
+    def _validate(self, entry):
+        """Return a healthy entry, reconnecting if the pooled one is stale or dead"""
+        now = time.monotonic()
+        stale = now - entry.created_at > self.max_lifetime
+        if not stale and not self._is_broken(entry.conn):
+            if now - entry.last_used < self.check_interval or self._ping(entry.conn):
+                return entry
+            with self._cond:
+                self._check_failures += 1
+        self._close(entry.conn)
+        with self._cond:
+            self._recycled += 1
+        return _PooledConnection(self._connect())
+
+    def _prune_idle(self, now):
+        """Close connections idle for too long while above the minimum size (lock held)"""
+        while (self._idle and self._size > self.minconn
+               and now - self._idle[0].last_used > self.max_idle):
+            entry = self._idle.popleft()
+            self._size -= 1
+            self._recycled += 1
+            self._close(entry.conn)
+
+    @staticmethod
+    def _is_broken(conn):
+        return bool(conn.closed) or (
+            conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN)
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
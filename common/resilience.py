@@ -0,0 +1,136 @@
+"""Circuit breakers and retry budgets for calls between the services"""
+import os
+import threading
+import time
+
+import requests
+
+from common.metrics import CallbackGauge, Counter
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_SECONDS = float(os.environ.get('CIRCUIT_RECOVERY_SECONDS', '30'))
+RETRY_BUDGET_RATIO = float(os.environ.get('RETRY_BUDGET_RATIO', '0.1'))
+RETRY_BUDGET_BURST = float(os.environ.get('RETRY_BUDGET_BURST', '10'))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breakers = {}
+_breakers_lock = threading.Lock()
+
+CIRCUIT_REJECTIONS = Counter('circuit_breaker_rejections_total',
+                             'Calls failed fast because the dependency circuit was open', ('service',))
+RETRIES = Counter('downstream_retries_total', 'Retried calls to downstream services', ('service',))
+CallbackGauge('circuit_breaker_state', 'Dependency circuit state (0 closed, 1 half-open, 2 open)', ('service',),
+              lambda: {(name, ): STATE_VALUES[b.state] for name, b in list(breakers.items())})
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a dependency whose circuit is open.
+
+    A ``requests.ConnectionError``, so callers already handling an
+    unreachable service need no changes.
+    """
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after ``failure_threshold`` consecutive failures.
+
+    While open every call fails immediately with CircuitOpenError. After
+    ``recovery_timeout`` seconds one probe call is let through (half-open);
+    its success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, recovery_timeout=CIRCUIT_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejections = 0
+        self.opened = 0
+        with _breakers_lock:
+            breakers[name] = self
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if (self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout
+                    and not self._probe_in_flight):
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            self.rejections += 1
+        CIRCUIT_REJECTIONS.labels(self.name).inc()
+        raise CircuitOpenError(f'{self.name} service circuit is open after repeated failures')
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opened += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """Give up a call without an outcome (it was cancelled), freeing the probe slot"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'times_opened': self.opened,
+                'rejections': self.rejections
+            }
+
+
+class RetryBudget:
+    """Caps retries at a fraction of recent traffic so retries cannot amplify an outage.
+
+    Every request deposits ``ratio`` of a token, every retry withdraws
+    one, and the balance never exceeds ``max_tokens``. With the defaults
+    at most about 10% extra load is generated once the initial allowance
+    is used up.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, max_tokens=RETRY_BUDGET_BURST):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._tokens = max_tokens
+
+    def record_request(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
@@ -0,0 +1,161 @@
+"""Pooled, tuned SQLite connections shared by the SQLite-backed services
+
+Each database keeps a small bounded pool of open connections that every
+request thread borrows from, instead of opening the file on every
+request (the services' request threads are short-lived, so per-thread
+connections would never be reused). Connections are configured once
+when they are opened: WAL mode, so readers no longer block the writer or
+each other, ``synchronous=NORMAL`` (safe under WAL, durable up to the
+last checkpoint on power loss), a busy timeout instead of immediate
+"database is locked" errors, a larger page cache and memory-mapped reads.
+Statements are kept compiled in each connection's statement cache and
+every query is timed through TimedSqliteConnection.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from common.deadlines import bounded_timeout
+from common.metrics import TimedSqliteConnection
+
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', '5'))
+SQLITE_CACHE_MB = int(os.environ.get('SQLITE_CACHE_MB', '16'))
+SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', '128'))
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', '256'))
+SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))
+SQLITE_POOL_TIMEOUT = float(os.environ.get('SQLITE_POOL_TIMEOUT', '5'))
+
+
+class PoolTimeout(Exception):
+    """Raised when no SQLite connection could be checked out within the timeout"""
+
+
+class SqliteDatabase:
+    """One SQLite file behind a bounded pool of at most ``pool_size`` connections.
+
+    ``with db.connect() as conn:`` borrows a connection, commits when the
+    block succeeds and rolls back when it raises, like ``sqlite3.connect``
+    used as a context manager, then returns the still-open connection to
+    the pool. Callers that find every connection in use wait up to
+    ``pool_timeout`` seconds (less if the request deadline is sooner).
+    """
+
+    def __init__(self, path, busy_timeout=SQLITE_BUSY_TIMEOUT, cache_mb=SQLITE_CACHE_MB,
+                 mmap_mb=SQLITE_MMAP_MB, statement_cache=SQLITE_STATEMENT_CACHE,
+                 pool_size=SQLITE_POOL_SIZE, pool_timeout=SQLITE_POOL_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.statement_cache = statement_cache
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0  # open pooled connections plus slots reserved for opens in progress
+        self._pid = os.getpid()
+        self._opened = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+
+    def open(self, **kwargs):
+        """A new configured connection owned by the caller (e.g. ``isolation_level=None`` for migrations)"""
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, cached_statements=self.statement_cache,
+                               factory=TimedSqliteConnection, **kwargs)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA cache_size = {-self.cache_mb * 1024}')
+        conn.execute(f'PRAGMA mmap_size = {self.mmap_mb * 1024 * 1024}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        with self._cond:
+            self._opened += 1
+        return conn
+
+    @contextmanager
+    def connect(self, timeout=None):
+        """Borrow a pooled connection for the with-block"""
+        conn = self.getconn(timeout)
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.putconn(conn)
+
+    def getconn(self, timeout=None):
+        """Check a connection out of the pool, waiting at most ``timeout`` (default: the pool's)"""
+        if timeout is None:
+            timeout = bounded_timeout(self.pool_timeout)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._forget_after_fork()
+            waited = False
+            while not self._idle and self._size >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f'No connection to {self.path} available within {timeout:.1f}s '
+                                      f'(pool size {self.pool_size})')
+                waited = True
+                self._cond.wait(remaining)
+            self._checkouts += 1
+            self._waits += waited
+            if self._idle:
+                # LIFO keeps the warmest connections (and their page caches) in use
+                return self._idle.pop()
+            self._size += 1
+        try:
+            # Pooled connections move between request threads, one at a time
+            return self.open(check_same_thread=False)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn):
+        """Return a connection to the pool, rolling back anything the borrower left open"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if os.getpid() != self._pid:
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def closeall(self):
+        """Close every idle connection; the pool reopens connections as needed"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'path': self.path,
+                'pool_size': self.pool_size,
+                'open': self._size,
+                'idle': len(self._idle),
+                'connections_opened': self._opened,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts
+            }
+
+    def _forget_after_fork(self):
+        # A connection must not be used across fork(), so a child process starts with an empty pool (lock held)
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
@@ -0,0 +1,41 @@
+"""Startup registration of the inline HTML templates as precompiled Jinja templates"""
+import os
+import tempfile
+
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache, TemplateError
+
+from common.compression import minify_html
+
+
+def register_templates(app, service, templates, cache_dir=None, minify=True):
+    """Compile ``templates`` ({name: source}) once and return {name: Template}.
+
+    The sources are registered on the app's Jinja environment under their
+    names and compiled immediately, so a broken template stops the service
+    at startup instead of failing the first request that renders it.
+    Compiled bytecode is cached on disk (``TEMPLATE_CACHE_DIR``, one
+    directory per service) and reused by every worker process. Pass the
+    returned Template objects to ``render_template`` to skip the name lookup
+    on each request. Sources are minified (see ``minify_html``) before
+    they are compiled unless ``minify`` is false.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'jinja-cache')),
+            service)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if minify:
+        templates = {name: minify_html(source) for name, source in templates.items()}
+
+    env = app.jinja_env
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    env.loader = ChoiceLoader([DictLoader(templates), env.loader])
+
+    compiled = {}
+    for name in templates:
+        try:
+            compiled[name] = env.get_template(name)
+        except TemplateError as e:
+            raise RuntimeError(f'Template {name} failed to compile: {e}') from e
+    return compiled
@@ -0,0 +1,250 @@
+"""Request tracing across the services with W3C ``traceparent`` propagation
+
+A service that receives a request without a ``traceparent`` header starts
+a new trace; otherwise it continues the caller's. Each request records a
+server span plus child spans for its downstream calls and database
+queries. When the request finishes its spans are exported if the trace
+was sampled (``TRACE_SAMPLE_RATE``, decided where the trace starts) or
+if the request took at least ``TRACE_SLOW_MS``, so slow requests are
+always kept. Exported traces are kept in memory for ``/debug/traces`` and
+appended to ``TRACE_EXPORT_PATH`` as JSON lines when it is set.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.1'))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '500'))
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH', '')
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '200'))
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+MAX_STATEMENT_LENGTH = 300
+
+_current_span = ContextVar('current_span', default=None)
+
+
+class _LocalTrace:
+    """The spans one service records for one request of a trace"""
+
+    __slots__ = ('trace_id', 'sampled', 'spans', 'lock')
+
+    def __init__(self, trace_id, sampled):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'service', 'start', 'duration',
+                 'attributes', '_start_counter')
+
+    def __init__(self, trace, name, kind, service, parent_id=None, attributes=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.service = service
+        self.start = time.time()
+        self._start_counter = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes or {}
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, duration=None):
+        self.duration = time.perf_counter() - self._start_counter if duration is None else duration
+        with self.trace.lock:
+            self.trace.spans.append(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'service': self.service,
+            'name': self.name,
+            'kind': self.kind,
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes
+        }
+
+
+class TraceBuffer:
+    """Recently exported traces, keyed by trace id, plus the optional JSONL file"""
+
+    def __init__(self, max_traces=TRACE_BUFFER_SIZE, path=TRACE_EXPORT_PATH):
+        self.max_traces = max_traces
+        self.path = path
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+
+    def export(self, spans):
+        records = [span.to_dict() for span in spans]
+        trace_id = records[0]['trace_id']
+        with self._lock:
+            self._traces.setdefault(trace_id, []).extend(records)
+            self._traces.move_to_end(trace_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+
+    def traces(self):
+        with self._lock:
+            return [(trace_id, list(spans)) for trace_id, spans in reversed(self._traces.items())]
+
+    def get(self, trace_id):
+        with self._lock:
+            return list(self._traces.get(trace_id, ()))
+
+
+buffer = TraceBuffer()
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_server_span(service, name, traceparent=None):
+    """Begin the span for an incoming request, continuing the caller's trace if there is one.
+
+    Returns (span, token); pass both to ``finish_server_span``.
+    """
+    match = TRACEPARENT_RE.match(traceparent or '')
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        trace = _LocalTrace(trace_id, bool(int(flags, 16) & 1))
+    else:
+        parent_id = None
+        trace = _LocalTrace(os.urandom(16).hex(), random.random() < TRACE_SAMPLE_RATE)
+    span = Span(trace, name, 'server', service, parent_id)
+    return span, _current_span.set(span)
+
+
+def finish_server_span(span, token):
+    """End a request's span and export the request's spans if the trace is kept"""
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # Finished in a different context than it was started in
+        _current_span.set(None)
+    span.end()
+    if span.trace.sampled or span.duration * 1000 >= TRACE_SLOW_MS:
+        with span.trace.lock:
+            spans = list(span.trace.spans)
+        buffer.export(spans)
+
+
+def start_span(name, kind='client', **attributes):
+    """Child of the current span, or None outside a traced request"""
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, name, kind, parent.service, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block of in-process work as a child span of the current request"""
+    child = start_span(name, 'internal', **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def record_query(system, statement, seconds):
+    """Add an already finished database query to the current trace"""
+    span = start_span(f'{system} query', 'client', **{'db.system': system,
+                                                      'db.statement': ' '.join(statement.split())[:MAX_STATEMENT_LENGTH]})
+    if span is not None:
+        span.start -= seconds
+        span.end(seconds)
+
+
+def init_tracing(app, service):
+    """Trace every request of ``app`` and serve the exported traces at /debug/traces"""
+    from flask import Response, g, jsonify, request
+
+    @app.before_request
+    def start_request_span():
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.trace_span, g.trace_token = start_server_span(service, f'{request.method} {route}',
+                                                        request.headers.get('traceparent'))
+
+    @app.after_request
+    def tag_response(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set('http.status_code', response.status_code)
+            response.headers['X-Trace-Id'] = span.trace.trace_id
+        return response
+
+    @app.teardown_request
+    def finish_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is not None:
+            if exc is not None:
+                span.set('error', repr(exc))
+            finish_server_span(span, g.pop('trace_token'))
+
+    @app.route('/debug/traces')
+    def list_traces():
+        summaries = []
+        for trace_id, spans in buffer.traces():
+            roots = [s for s in spans if s['kind'] == 'server']
+            root = min(roots or spans, key=lambda s: s['start'])
+            summaries.append({'trace_id': trace_id, 'name': root['name'], 'start': root['start'],
+                              'duration_ms': root['duration_ms'], 'spans': len(spans)})
+        return jsonify(summaries)
+
+    @app.route('/debug/traces/<trace_id>')
+    def show_trace(trace_id):
+        spans = buffer.get(trace_id)
+        if not spans:
+            return 'Trace not found', 404
+        return Response(format_waterfall(spans), mimetype='text/plain')
+
+
+def format_waterfall(spans):
+    """Plain-text timeline of a trace's spans, children indented under their parents"""
+    spans = sorted(spans, key=lambda s: s['start'])
+    origin = spans[0]['start']
+    children = {}
+    ids = {s['span_id'] for s in spans}
+    for s in spans:
+        children.setdefault(s['parent_id'] if s['parent_id'] in ids else None, []).append(s)
+
+    lines = [f"trace {spans[0]['trace_id']}"]
+
+    def walk(parent_id, depth):
+        for s in children.get(parent_id, []):
+            offset = (s['start'] - origin) * 1000
+            detail = s['attributes'].get('db.statement') or s['attributes'].get('http.status_code', '')
+            lines.append(f"{offset:9.1f}ms {s['duration_ms']:9.1f}ms  {'  ' * depth}[{s['service']}] {s['name']}"
+                         + (f"  {detail}" if detail != '' else ''))
+            walk(s['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines) + '\n'
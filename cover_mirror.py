@@ -0,0 +1,272 @@
+"""Background mirroring of externally hosted album covers into the cover store"""
+import heapq
+import ipaddress
+import random
+import socket
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from covers import UnsupportedImage
+
+MAX_COVER_BYTES = 10 * 1024 * 1024
+MAX_REDIRECTS = 5
+# Statuses worth retrying; any other error response is treated as permanent
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class MirrorError(Exception):
+    """A cover could not be mirrored; ``retry`` tells whether a later attempt may succeed"""
+
+    def __init__(self, message, retry=True, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.retry_after = retry_after
+
+
+def is_external(url):
+    """Whether ``url`` points at another host rather than at this store"""
+    parsed = urlparse(url or '')
+    return parsed.scheme in ('http', 'https') and bool(parsed.netloc)
+
+
+def is_public_address(address):
+    """Whether ``address`` is a globally routable unicast IP (not loopback, private, link-local or metadata)"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_public_url(url):
+    """Raise MirrorError unless ``url`` is http(s) and every address its host resolves to is public"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise MirrorError(f'{url} is not an http(s) URL', retry=False)
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise MirrorError(f'Resolving {parsed.hostname} failed: {e}')
+    for info in infos:
+        if not is_public_address(info[4][0]):
+            raise MirrorError(f'{url} resolves to the non-public address {info[4][0]}', retry=False)
+
+
+class _PublicOnlyConnectionMixin:
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = sock.getpeername()[0]
+        if not is_public_address(address):
+            # The host resolved to a public address when checked but not when connecting (DNS rebinding)
+            sock.close()
+            raise MirrorError(f'{self.host} connected to the non-public address {address}', retry=False)
+        return sock
+
+
+class _PublicHTTPConnection(_PublicOnlyConnectionMixin, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnlyConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicOnlyAdapter(HTTPAdapter):
+    """Transport adapter whose direct connections fail unless the peer is a public address"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _PublicHTTPConnectionPool,
+                                                   'https': _PublicHTTPSConnectionPool}
+
+
+class _LimitedReader:
+    """File-like view of a streamed response that fails once ``limit`` bytes have been read"""
+
+    def __init__(self, response, limit):
+        self._chunks = response.iter_content(64 * 1024)
+        self._buffer = b''
+        self._remaining = limit
+
+    def read(self, size=-1):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._remaining -= len(chunk)
+            if self._remaining < 0:
+                raise MirrorError('Cover exceeds the size limit', retry=False)
+            self._buffer = chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class CoverMirror:
+    """Worker thread that copies external cover URLs into the local store.
+
+    ``submit(album_id, url)`` queues a download. Each download is validated
+    (status, declared type and size, image signature) and stored in
+    ``store``, and ``on_mirrored(album_id, url, cover_name)`` is then called
+    to repoint the album. Transient failures are retried with exponential
+    backoff and jitter up to ``max_attempts`` times. Pass a
+    ``requests.Session`` to control how covers are fetched.
+
+    URLs come from users, so unless ``allow_private`` is set every URL and
+    redirect target must resolve to public addresses only, and the address
+    actually connected to is checked again (the session gets a
+    PublicOnlyAdapter); loopback, private, link-local (cloud metadata) and
+    other internal hosts are never fetched.
+    """
+
+    def __init__(self, store, on_mirrored, session=None, timeout=(2.0, 10.0), max_bytes=MAX_COVER_BYTES,
+                 max_attempts=5, backoff=1.0, max_backoff=300.0, allow_private=False):
+        self.store = store
+        self.on_mirrored = on_mirrored
+        self.session = session or requests.Session()
+        self.session.headers.setdefault('User-Agent', 'music-store-cover-mirror')
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.allow_private = allow_private
+        if not allow_private:
+            self.session.mount('http://', PublicOnlyAdapter())
+            self.session.mount('https://', PublicOnlyAdapter())
+
+        self._cond = threading.Condition()
+        self._pending = []  # heap of (due time, sequence, album id, url, attempt)
+        self._sequence = 0
+        self._active = 0
+        self._thread = None
+        self.mirrored = 0
+        self.failed = 0
+        self.retries = 0
+
+    def submit(self, album_id, url, delay=0.0, attempt=1):
+        with self._cond:
+            self._sequence += 1
+            heapq.heappush(self._pending, (time.monotonic() + delay, self._sequence, album_id, url, attempt))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='cover-mirror', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def mirror(self, url):
+        """Download ``url`` into the store and return the cover name; raises MirrorError"""
+        response = self._fetch(url)
+        with response:
+            if response.status_code != 200:
+                retry_after = response.headers.get('Retry-After')
+                raise MirrorError(f'Fetching {url} returned {response.status_code}',
+                                  retry=response.status_code in RETRY_STATUSES,
+                                  retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+            content_type = response.headers.get('Content-Type', '')
+            if content_type and not content_type.startswith(('image/', 'application/octet-stream')):
+                raise MirrorError(f'{url} is not an image ({content_type})', retry=False)
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                raise MirrorError(f'{url} is larger than {self.max_bytes} bytes', retry=False)
+            try:
+                return self.store.put_stream(_LimitedReader(response, self.max_bytes))
+            except UnsupportedImage as e:
+                raise MirrorError(f'{url}: {e}', retry=False)
+            except requests.RequestException as e:
+                raise MirrorError(f'Reading {url} failed: {e}')
+
+    def _fetch(self, url):
+        """Streamed response for ``url``, following redirects only to allowed hosts"""
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            if not self.allow_private:
+                check_public_url(target)
+            try:
+                response = self.session.get(target, stream=True, timeout=self.timeout, allow_redirects=False)
+            except requests.RequestException as e:
+                raise MirrorError(f'Fetching {url} failed: {e}')
+            if not response.is_redirect:
+                return response
+            target = urljoin(target, response.headers['Location'])
+            response.close()
+        raise MirrorError(f'{url} redirected more than {MAX_REDIRECTS} times', retry=False)
+
+    def wait_idle(self, timeout=None):
+        """Block until nothing is queued or downloading; returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._pending),
+                'active': self._active,
+                'mirrored': self.mirrored,
+                'failed': self.failed,
+                'retries': self.retries
+            }
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    wait = self._pending[0][0] - time.monotonic()
+                    if wait <= 0:
+                        self._active += 1
+                        return heapq.heappop(self._pending)[2:]
+                else:
+                    wait = None
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            album_id, url, attempt = self._next_job()
+            try:
+                self._process(album_id, url, attempt)
+            except Exception as e:
+                print(f"Cover mirror: unexpected error for album {album_id}: {e}")
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def _process(self, album_id, url, attempt):
+        try:
+            cover_name = self.mirror(url)
+        except MirrorError as e:
+            if e.retry and attempt < self.max_attempts:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                print(f"Cover mirror: {e}; retry {attempt}/{self.max_attempts - 1} for album {album_id} in {delay:.1f}s")
+                with self._cond:
+                    self.retries += 1
+                self.submit(album_id, url, delay=delay, attempt=attempt + 1)
+            else:
+                print(f"Cover mirror: giving up on album {album_id}: {e}")
+                with self._cond:
+                    self.failed += 1
+            return
+        self.on_mirrored(album_id, url, cover_name)
+        with self._cond:
+            self.mirrored += 1
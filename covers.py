@@ -0,0 +1,344 @@
+"""Content-addressed storage for album cover images"""
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Covers are named <sha256 of the bytes>.<type>, so a URL always refers to the same image
+COVER_NAME_RE = re.compile(r'^[0-9a-f]{64}\.(jpg|png|gif|webp)$')
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Resized variants that may be requested; anything else is rejected so the cache cannot be flooded
+VARIANT_WIDTHS = (160, 280, 560, 1120)
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+VARIANT_QUALITY = 80
+
+# Covers are reduced to this size before their pixel statistics are taken
+SUMMARY_SIZE = 64
+# Width of the blurred placeholder inlined into the storefront; browsers smooth it when scaling up
+PLACEHOLDER_WIDTH = 12
+
+
+class UnsupportedImage(ValueError):
+    """Raised when the stored bytes are not a supported image type"""
+
+
+def sniff_image_type(head):
+    """File extension for an image from its first bytes, or None if unsupported"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class CoverStore:
+    """Stores covers under their content hash, keeping one copy per distinct image.
+
+    Files live at ``<root>/<first two hex digits>/<sha256>.<type>`` so no
+    directory grows too large, and are written through a temporary file
+    and an atomic rename so readers never see a partial image.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, name):
+        """Filesystem path of a stored cover, or None for names that are not content hashes"""
+        if not COVER_NAME_RE.match(name):
+            return None
+        return os.path.join(self.root, name[:2], name)
+
+    def exists(self, name):
+        path = self.path_for(name)
+        return path is not None and os.path.exists(path)
+
+    def put_stream(self, stream):
+        """Store the image read from ``stream`` and return its content-addressed name"""
+        upload = CoverUpload(self)
+        try:
+            while True:
+                chunk = stream.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                upload.write(chunk)
+            return self.put_upload(upload)
+        finally:
+            upload.close()
+
+    def put_file(self, path):
+        """Store a copy of the image at ``path`` and return its name"""
+        with open(path, 'rb') as f:
+            return self.put_stream(f)
+
+    def put_upload(self, upload):
+        """Move a fully received CoverUpload into the store and return its name"""
+        upload.flush()
+        return self._commit(upload.path, upload.hexdigest(), upload.image_type)
+
+    def _commit(self, tmp_path, digest, image_type):
+        """Move a fully written temporary file into place unless the image is already stored"""
+        if image_type is None:
+            raise UnsupportedImage('Cover is not a JPEG, PNG, GIF or WebP image')
+        name = f'{digest}.{image_type}'
+        path = self.path_for(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return name
+
+
+class CoverUpload:
+    """Temporary file in a CoverStore that hashes and checks a cover while it is written.
+
+    The SHA-256 and image type are known as soon as the last chunk has
+    arrived, so storing the upload is a rename with no second pass over
+    the data. Once the first bytes show the data is not a supported image,
+    the rest is discarded instead of written. Closing an upload that was
+    not stored deletes its temporary file.
+    """
+
+    def __init__(self, store):
+        fd, self.path = tempfile.mkstemp(dir=store.tmp_dir)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self._head = b''
+        self.size = 0
+        self.rejected = False
+
+    def write(self, data):
+        if self.rejected:
+            return len(data)
+        if len(self._head) < 16:
+            self._head += data[:16 - len(self._head)]
+            if len(self._head) == 16 and sniff_image_type(self._head) is None:
+                self.rejected = True
+                return len(data)
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def image_type(self):
+        return None if self.rejected else sniff_image_type(self._head)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        # seek/read/flush etc. go to the underlying file
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def index_legacy_covers(store, directories):
+    """Copy every cover file found in ``directories`` into ``store``.
+
+    Returns {legacy filename: content-addressed name}. Byte-identical
+    files map to the same name. Files that are not supported images are
+    skipped. The originals are left in place; once albums point at the
+    store they are no longer served and can be deleted by hand.
+    """
+    mapping = {}
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if not os.path.isfile(path):
+                continue
+            try:
+                mapping[filename] = store.put_file(path)
+            except UnsupportedImage:
+                continue
+    return mapping
+
+
+def render_variant(source_path, width, fmt, dest):
+    """Write ``source_path`` scaled down to ``width`` pixels wide as ``fmt`` into the open file ``dest``"""
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            # Never upscale; the height follows the aspect ratio
+            image.thumbnail((width, image.height), Image.LANCZOS)
+        if fmt == 'jpeg' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        if fmt == 'jpeg':
+            image.save(dest, 'JPEG', quality=VARIANT_QUALITY, optimize=True, progressive=True)
+        else:
+            image.save(dest, VARIANT_FORMATS[fmt], quality=VARIANT_QUALITY, method=4)
+
+
+def dominant_color(pixels):
+    """Most common color of an (N, 3) uint8 pixel array as ``#rrggbb``.
+
+    Pixels are bucketed at 4 bits per channel so near-identical shades
+    count together, and the mean of the fullest bucket is returned.
+    """
+    buckets = (pixels >> 4).astype(np.int32)
+    keys = (buckets[:, 0] << 8) | (buckets[:, 1] << 4) | buckets[:, 2]
+    top = np.bincount(keys, minlength=4096).argmax()
+    r, g, b = np.rint(pixels[keys == top].mean(axis=0)).astype(int)
+    return f'#{r:02x}{g:02x}{b:02x}'
+
+
+def cover_summary(source_path):
+    """(dominant color, blurred placeholder data URI) for a stored cover"""
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder skip most of the work for large covers
+        image.draft('RGB', (SUMMARY_SIZE, SUMMARY_SIZE))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((SUMMARY_SIZE, SUMMARY_SIZE), Image.BOX)
+    color = dominant_color(np.asarray(image).reshape(-1, 3))
+
+    height = max(1, round(PLACEHOLDER_WIDTH * image.height / image.width))
+    placeholder = image.resize((PLACEHOLDER_WIDTH, height), Image.BOX).filter(ImageFilter.GaussianBlur(1))
+    buf = io.BytesIO()
+    placeholder.save(buf, 'WEBP', quality=40)
+    return color, 'data:image/webp;base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+class VariantCache:
+    """Size-bounded on-disk LRU of resized cover variants.
+
+    Variants are derived from immutable covers, so an entry never goes
+    stale and only has to be evicted for space. The least recently used
+    files are deleted once the total exceeds ``max_bytes``; recency is
+    kept in memory and mirrored in file mtimes so it survives a restart.
+    Concurrent requests for a variant that is still being generated wait
+    for that one generation instead of resizing the same image again.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        existing = []
+        for entry in os.scandir(root):
+            if entry.is_file():
+                stat = entry.stat()
+                existing.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self.size += size
+
+    def path_for(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key, render):
+        """Path of the cached variant ``key``, calling ``render(file)`` to create it on a miss"""
+        while True:
+            owner = waiter = None
+            with self._lock:
+                hit = key in self._entries
+                if hit:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    waiter = self._inflight.get(key)
+                    if waiter is None:
+                        owner = self._inflight[key] = threading.Event()
+                        self.misses += 1
+            if hit:
+                path = self.path_for(key)
+                try:
+                    os.utime(path)
+                    return path
+                except FileNotFoundError:
+                    # Evicted by another process sharing the directory
+                    self._forget(key)
+                    continue
+            if waiter is not None:
+                waiter.wait()
+                continue
+            try:
+                return self._generate(key, render)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                owner.set()
+
+    def _generate(self, key, render):
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    render(tmp)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._entries[key] = size
+            self.size += size
+            evicted = self._evict()
+        for name in evicted:
+            try:
+                os.unlink(self.path_for(name))
+            except FileNotFoundError:
+                pass
+        return path
+
+    def _evict(self):
+        """Drop least recently used entries over the size bound; the newest entry is always kept"""
+        evicted = []
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            evicted.append(name)
+        return evicted
+
+    def _forget(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self.size -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'generating': len(self._inflight)
+            }
@@ -8,6 +8,9 @@ CREATE TABLE IF NOT EXISTS albums (
     artist VARCHAR(255) NOT NULL,
     price DECIMAL(10,2) NOT NULL,
     cover_url TEXT,
+    -- Computed from the cover when it is stored, inlined while the image loads
+    cover_color VARCHAR(7),
+    cover_placeholder TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
@@ -24,9 +27,42 @@ CREATE TABLE IF NOT EXISTS orders (
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_albums_artist ON albums(artist);
 CREATE INDEX IF NOT EXISTS idx_albums_price ON albums(price);
+-- Keyset pagination on (sort column, id) for the storefront and /api/albums
+CREATE INDEX IF NOT EXISTS idx_albums_created_at_id ON albums(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_albums_price_id ON albums(price, id);
+CREATE INDEX IF NOT EXISTS idx_albums_name_id ON albums(name, id);
+-- Catalog version lookups (COUNT(*), MAX(updated_at)) used by the store's catalog cache
+CREATE INDEX IF NOT EXISTS idx_albums_updated_at ON albums(updated_at);
 CREATE INDEX IF NOT EXISTS idx_orders_album_id ON orders(album_id);
 CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
 
+-- Shopping carts of the cart service when it runs with CART_BACKEND=postgres
+CREATE TABLE IF NOT EXISTS cart_items (
+    id SERIAL PRIMARY KEY,
+    session_id VARCHAR(64) NOT NULL,
+    album_id INTEGER NOT NULL,
+    album_name VARCHAR(255) NOT NULL,
+    artist VARCHAR(255) NOT NULL,
+    price DOUBLE PRECISION NOT NULL,
+    quantity INTEGER NOT NULL,
+    cover_url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (session_id, album_id)
+);
+CREATE INDEX IF NOT EXISTS idx_cart_items_session ON cart_items(session_id, created_at);
+
+-- Background payment jobs of the cart service (CART_BACKEND=postgres)
+CREATE TABLE IF NOT EXISTS cart_payments (
+    id VARCHAR(32) PRIMARY KEY,
+    session_id VARCHAR(64) NOT NULL,
+    status VARCHAR(16) NOT NULL,
+    message TEXT,
+    details TEXT,
+    created_at DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS idx_cart_payments_created_at ON cart_payments(created_at);
+
 -- Create trigger to update updated_at timestamp
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
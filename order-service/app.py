@@ -1,16 +1,32 @@
-from flask import Flask, render_template_string, request, jsonify
-import sqlite3
+from flask import Flask, render_template, request, jsonify
 import os
+import sys
 import json
 from datetime import datetime
 
+# Shared helpers live in common/ at the repository root (copied to /common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.templating import register_templates
+from common.assets import register_assets
+from common.compression import init_compression
+from common.metrics import init_metrics
+from common.sqlite_db import SqliteDatabase
+from common.tracing import init_tracing
+from common.deadlines import check_deadline, init_deadlines
+
 app = Flask(__name__)
+init_metrics(app)
+init_tracing(app, 'orders')
+init_deadlines(app)
+compressor = init_compression(app)
 
 # Configuration
 ORDER_DB_PATH = os.environ.get('ORDER_DB_PATH', 'orders.db')
+order_db = SqliteDatabase(ORDER_DB_PATH)
+MAX_ORDERS_PAGE_SIZE = 1000
 
 def init_order_db():
-    with sqlite3.connect(ORDER_DB_PATH) as conn:
+    with order_db.connect() as conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -30,6 +46,7 @@ def init_order_db():
             quantity INTEGER NOT NULL,
             FOREIGN KEY(order_id) REFERENCES orders(id)
         )''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)')
         conn.commit()
 
 init_order_db()
@@ -44,6 +61,7 @@ def generate_order_number():
 @app.route('/api/orders', methods=['POST'])
 def create_order():
     """API endpoint to create a new order"""
+    check_deadline('creating the order')
     try:
         data = request.get_json()
         
@@ -60,7 +78,7 @@ def create_order():
         # Create order
         order_number = generate_order_number()
         
-        with sqlite3.connect(ORDER_DB_PATH) as conn:
+        with order_db.connect() as conn:
             c = conn.cursor()
             
             # Insert order
@@ -94,7 +112,7 @@ def create_order():
 def get_orders():
     """API endpoint to get all orders"""
     try:
-        with sqlite3.connect(ORDER_DB_PATH) as conn:
+        with order_db.connect() as conn:
             c = conn.cursor()
             orders = c.execute('''
                 SELECT o.id, o.order_number, o.total_amount, o.status, o.created_at,
@@ -117,11 +135,72 @@ def get_orders():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/orders/with-items', methods=['GET'])
+def get_orders_with_items():
+    """API endpoint to page through orders with their items embedded (?limit=&cursor=)"""
+    try:
+        limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'error': 'limit and cursor must be integers'}), 400
+    if not 1 <= limit <= MAX_ORDERS_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_ORDERS_PAGE_SIZE}'}), 400
+    
+    try:
+        with order_db.connect() as conn:
+            c = conn.cursor()
+            # Newest orders first; ids grow with created_at so the primary key is the keyset.
+            # One extra order is fetched to tell whether there is a next page.
+            rows = c.execute('''
+                SELECT o.id, o.order_number, o.total_amount, o.status, o.created_at,
+                       oi.album_id, oi.album_name, oi.artist, oi.price, oi.quantity
+                FROM (
+                    SELECT id, order_number, total_amount, status, created_at
+                    FROM orders
+                    WHERE ? IS NULL OR id < ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                ) o
+                LEFT JOIN order_items oi ON oi.order_id = o.id
+                ORDER BY o.id DESC, oi.id
+            ''', (cursor, cursor, limit + 1)).fetchall()
+        
+        orders = []
+        for row in rows:
+            if not orders or orders[-1]['id'] != row[0]:
+                orders.append({
+                    'id': row[0],
+                    'order_number': row[1],
+                    'total_amount': row[2],
+                    'status': row[3],
+                    'created_at': row[4],
+                    'items': []
+                })
+            if row[5] is not None:
+                orders[-1]['items'].append({
+                    'album_id': row[5],
+                    'album_name': row[6],
+                    'artist': row[7],
+                    'price': row[8],
+                    'quantity': row[9]
+                })
+        
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = str(orders[-1]['id'])
+        
+        return jsonify({'orders': orders, 'next_cursor': next_cursor}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/orders/<int:order_id>', methods=['GET'])
 def get_order(order_id):
     """API endpoint to get a specific order with items"""
     try:
-        with sqlite3.connect(ORDER_DB_PATH) as conn:
+        with order_db.connect() as conn:
             c = conn.cursor()
             
             # Get order details
@@ -160,6 +239,7 @@ def get_order(order_id):
 @app.route('/api/orders/<int:order_id>/status', methods=['PUT'])
 def update_order_status(order_id):
     """API endpoint to update order status"""
+    check_deadline('updating the order')
     try:
         data = request.get_json()
         new_status = data.get('status')
@@ -167,7 +247,7 @@ def update_order_status(order_id):
         if not new_status:
             return jsonify({'error': 'Status is required'}), 400
         
-        with sqlite3.connect(ORDER_DB_PATH) as conn:
+        with order_db.connect() as conn:
             c = conn.cursor()
             c.execute('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
             
@@ -184,7 +264,7 @@ def update_order_status(order_id):
 @app.route('/')
 def orders_dashboard():
     """Dashboard to view all orders"""
-    with sqlite3.connect(ORDER_DB_PATH) as conn:
+    with order_db.connect() as conn:
         c = conn.cursor()
         orders = c.execute('''
             SELECT o.id, o.order_number, o.total_amount, o.status, o.created_at,
@@ -195,12 +275,12 @@ def orders_dashboard():
             ORDER BY o.created_at DESC
         ''').fetchall()
     
-    return render_template_string(ORDERS_DASHBOARD_HTML, orders=orders)
+    return render_template(TEMPLATES['orders_dashboard.html'], orders=orders)
 
 @app.route('/order/<int:order_id>')
 def order_detail(order_id):
     """Detailed view of a specific order"""
-    with sqlite3.connect(ORDER_DB_PATH) as conn:
+    with order_db.connect() as conn:
         c = conn.cursor()
         
         # Get order details
@@ -218,7 +298,7 @@ def order_detail(order_id):
             FROM order_items WHERE order_id = ?
         ''', (order_id,)).fetchall()
     
-    return render_template_string(ORDER_DETAIL_HTML, order=order, items=items)
+    return render_template(TEMPLATES['order_detail.html'], order=order, items=items)
 
 # HTML Templates
 ORDERS_DASHBOARD_HTML = '''
@@ -228,178 +308,8 @@ ORDERS_DASHBOARD_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Orders Dashboard - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-            text-align: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .dashboard-card {
-            background: white;
-            border-radius: 16px;
-            padding: 30px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e5e9;
-        }
-
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-
-        .stat-card {
-            background: white;
-            color: #1a1a1a;
-            padding: 20px;
-            border-radius: 12px;
-            text-align: center;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .stat-number {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 5px;
-            color: #667eea;
-        }
-
-        .stat-label {
-            font-size: 1rem;
-            color: #666;
-            font-weight: 600;
-        }
-
-        .orders-table {
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 20px;
-        }
-
-        .orders-table th,
-        .orders-table td {
-            padding: 12px;
-            text-align: left;
-            border-bottom: 1px solid #e1e5e9;
-            color: #1a1a1a;
-        }
-
-        .orders-table th {
-            background: #f8f9fa;
-            font-weight: 700;
-            color: #1a1a1a;
-        }
-
-        .orders-table tr:hover {
-            background: #f8f9fa;
-        }
-
-        .status-badge {
-            padding: 4px 8px;
-            border-radius: 12px;
-            font-size: 0.8rem;
-            font-weight: 500;
-        }
-
-        .status-pending {
-            background: #fff3cd;
-            color: #856404;
-        }
-
-        .status-confirmed {
-            background: #d1ecf1;
-            color: #0c5460;
-        }
-
-        .status-shipped {
-            background: #d4edda;
-            color: #155724;
-        }
-
-        .status-delivered {
-            background: #c3e6cb;
-            color: #155724;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 12px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 0.9rem;
-            font-weight: 600;
-            text-decoration: none;
-            display: inline-block;
-            transition: all 0.3s ease;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        .empty-state {
-            text-align: center;
-            padding: 60px 20px;
-            color: #666;
-        }
-
-        @media (max-width: 768px) {
-            .orders-table {
-                font-size: 0.9rem;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .container {
-                padding: 0 16px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/orders_dashboard.css') }}">
 </head>
 <body>
     <div class="container">
@@ -477,187 +387,8 @@ ORDER_DETAIL_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Order Details - Metal Music Store</title>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap" rel="stylesheet">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-
-        body {
-            font-family: 'Inter', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background-color: #ffffff;
-            color: #1a1a1a;
-            line-height: 1.6;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }
-
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 0 20px;
-        }
-
-        /* Header */
-        .header {
-            background: #1a1a1a;
-            color: white;
-            padding: 20px 0;
-            position: sticky;
-            top: 0;
-            z-index: 100;
-            box-shadow: 0 2px 20px rgba(0,0,0,0.3);
-            margin-bottom: 40px;
-            text-align: center;
-        }
-
-        .header h1 {
-            font-size: 2.5rem;
-            font-weight: 800;
-            margin-bottom: 10px;
-            color: #ffffff;
-            letter-spacing: -0.5px;
-        }
-
-        .order-card {
-            background: white;
-            border-radius: 16px;
-            padding: 30px;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-            border: 1px solid #e1e5e9;
-        }
-
-        .order-header {
-            background: white;
-            border-radius: 12px;
-            padding: 20px;
-            margin-bottom: 30px;
-            border-left: 4px solid #667eea;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 4px 20px rgba(0,0,0,0.08);
-        }
-
-        .order-header h3 {
-            color: #1a1a1a;
-            margin-bottom: 15px;
-            font-weight: 700;
-        }
-
-        .order-info {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 20px;
-        }
-
-        .info-item {
-            margin-bottom: 10px;
-        }
-
-        .info-label {
-            font-weight: 600;
-            color: #555;
-        }
-
-        .info-value {
-            color: #333;
-        }
-
-        .items-section {
-            margin-top: 30px;
-        }
-
-        .items-section h3 {
-            color: #667eea;
-            margin-bottom: 20px;
-        }
-
-        .item-list {
-            list-style: none;
-        }
-
-        .item {
-            background: white;
-            padding: 15px;
-            border-radius: 8px;
-            margin-bottom: 10px;
-            border-left: 4px solid #667eea;
-            border: 1px solid #e1e5e9;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-        }
-
-        .item-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 5px;
-        }
-
-        .item-name {
-            font-weight: 600;
-            color: #333;
-        }
-
-        .item-price {
-            color: #667eea;
-            font-weight: bold;
-        }
-
-        .item-details {
-            color: #666;
-            font-size: 0.9rem;
-        }
-
-        .order-total {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            padding: 20px;
-            border-radius: 12px;
-            margin-top: 30px;
-            text-align: center;
-        }
-
-        .total-amount {
-            font-size: 2rem;
-            font-weight: bold;
-            margin-bottom: 5px;
-        }
-
-        .btn {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            border: none;
-            padding: 14px 20px;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 1rem;
-            font-weight: 600;
-            text-decoration: none;
-            display: inline-block;
-            margin-top: 20px;
-            transition: all 0.3s ease;
-        }
-
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 8px 25px rgba(102, 126, 234, 0.3);
-        }
-
-        @media (max-width: 768px) {
-            .order-info {
-                grid-template-columns: 1fr;
-            }
-            
-            .header h1 {
-                font-size: 2rem;
-            }
-            
-            .container {
-                padding: 0 16px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/fonts.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('css/order_detail.css') }}">
 </head>
 <body>
     <div class="container">
@@ -720,5 +451,13 @@ ORDER_DETAIL_HTML = '''
 </html>
 '''
 
+# Compile the templates once at startup
+TEMPLATES = register_templates(app, 'orders', {
+    'orders_dashboard.html': ORDERS_DASHBOARD_HTML,
+    'order_detail.html': ORDER_DETAIL_HTML
+})
+# Content-hashed CSS bundles, served at /assets/orders/
+register_assets(app, 'orders', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
@@ -0,0 +1,48 @@
+"""Cache of rendered storefront pages keyed by strong ETag"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def make_etag(*parts):
+    """Strong ETag derived from everything the page content depends on"""
+    return hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+
+class RenderedPageCache:
+    """Bounded LRU of rendered page bodies.
+
+    Entries are keyed by the page's ETag, which already encodes the catalog
+    version, so a catalog change simply stops old entries from being hit
+    and they age out.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, etag, render):
+        """Return the body cached under ``etag``, rendering and storing it on a miss"""
+        with self._lock:
+            body = self._pages.get(etag)
+            if body is not None:
+                self._pages.move_to_end(etag)
+                self.hits += 1
+                return body
+            self.misses += 1
+
+        body = render()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        with self._lock:
+            self._pages[etag] = body
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+        return body
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
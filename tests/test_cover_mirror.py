@@ -0,0 +1,130 @@
+"""CoverMirror against a local http.server stand-in for an external cover host"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cover_mirror import CoverMirror, MirrorError
+from covers import CoverStore
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 256
+
+
+class CoverHost(BaseHTTPRequestHandler):
+    """Serves /cover.png, /flaky/<n>.png (503 for the first n requests), /down.png and /big.png"""
+
+    hits = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] = hits = self.hits.get(self.path, 0) + 1
+        if self.path == '/cover.png':
+            self._send(200, PNG)
+        elif self.path.startswith('/flaky/'):
+            failures = int(self.path.split('/')[2].split('.')[0])
+            self._send(503, b'busy') if hits <= failures else self._send(200, PNG)
+        elif self.path == '/big.png':
+            self._send(200, PNG + b'\x00' * 4096)
+        elif self.path == '/redirect.png':
+            self.send_response(302)
+            self.send_header('Location', '/cover.png')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self._send(503, b'down')
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'image/png' if status == 200 else 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CoverMirrorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CoverHost)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        CoverHost.hits.clear()
+        self.root = tempfile.mkdtemp()
+        self.store = CoverStore(self.root)
+        self.mirrored = []
+        self.mirror = CoverMirror(self.store, lambda *args: self.mirrored.append(args), max_attempts=3,
+                                  backoff=0.01, allow_private=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_mirrors_cover(self):
+        url = self.base_url + '/cover.png'
+        self.mirror.submit(1, url)
+        self.assertTrue(self.mirror.wait_idle(10))
+        self.assertEqual(len(self.mirrored), 1)
+        album_id, mirrored_url, cover_name = self.mirrored[0]
+        self.assertEqual((album_id, mirrored_url), (1, url))
+        self.assertTrue(self.store.exists(cover_name))
+        self.assertEqual(self.mirror.stats()['mirrored'], 1)
+
+    def test_retries_after_failure(self):
+        self.mirror.submit(2, self.base_url + '/flaky/2.png')
+        self.assertTrue(self.mirror.wait_idle(10))
+        self.assertEqual(len(self.mirrored), 1)
+        self.assertEqual(CoverHost.hits['/flaky/2.png'], 3)
+        self.assertEqual(self.mirror.stats()['retries'], 2)
+
+    def test_gives_up_after_max_attempts(self):
+        self.mirror.submit(3, self.base_url + '/down.png')
+        self.assertTrue(self.mirror.wait_idle(10))
+        self.assertEqual(self.mirrored, [])
+        self.assertEqual(CoverHost.hits['/down.png'], 3)
+        stats = self.mirror.stats()
+        self.assertEqual((stats['failed'], stats['retries']), (1, 2))
+
+    def test_follows_redirects(self):
+        self.assertTrue(self.store.exists(self.mirror.mirror(self.base_url + '/redirect.png')))
+
+    def test_rejects_covers_over_size_limit(self):
+        self.mirror.max_bytes = len(PNG)
+        with self.assertRaises(MirrorError) as raised:
+            self.mirror.mirror(self.base_url + '/big.png')
+        self.assertFalse(raised.exception.retry)
+
+    def test_refuses_private_addresses(self):
+        mirror = CoverMirror(self.store, lambda *args: None)
+        for url in (self.base_url + '/cover.png', 'http://localhost/cover.png',
+                    'http://169.254.169.254/latest/meta-data/', 'http://10.0.0.1/cover.png'):
+            with self.assertRaises(MirrorError) as raised:
+                mirror.mirror(url)
+            self.assertFalse(raised.exception.retry)
+        self.assertEqual(CoverHost.hits, {})
+
+    def test_refuses_host_that_resolves_differently_on_connect(self):
+        mirror = CoverMirror(self.store, lambda *args: None)
+        # Connect directly even if the environment configures a proxy
+        mirror.session.trust_env = False
+        # The name looked public when checked but the connection went to a private address
+        with mock.patch('cover_mirror.check_public_url'):
+            with self.assertRaisesRegex(MirrorError, 'connected to the non-public address'):
+                mirror.mirror(self.base_url + '/cover.png')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,32 @@
 from flask import Flask, request, jsonify, session
-import sqlite3
 import os
+import sys
 import hashlib
 import secrets
 from functools import wraps
 
+# Shared helpers live in common/ at the repository root (copied to /common in the image)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.compression import init_compression
+from common.metrics import init_metrics
+from common.sqlite_db import SqliteDatabase
+from common.tracing import init_tracing
+from common.deadlines import check_deadline, init_deadlines
+
 app = Flask(__name__)
 app.secret_key = 'users-secret-key-here'
+init_metrics(app)
+init_tracing(app, 'users')
+init_deadlines(app)
+compressor = init_compression(app)
 
 # Configuration
 USERS_DB_PATH = os.environ.get('USERS_DB_PATH', 'users.db')
+users_db = SqliteDatabase(USERS_DB_PATH)
 
 def init_users_db():
     """Initialize the users database with default admin user"""
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -59,7 +72,7 @@ def login():
     username = data['username']
     password = data['password']
     
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         user = c.execute('SELECT id, username, password_hash, role FROM users WHERE username = ?', 
                         (username,)).fetchone()
@@ -76,7 +89,8 @@ def login():
     session_token = generate_session_token()
     
     # Store session in database (in production, use Redis or similar)
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    check_deadline('creating the session')
+    with users_db.connect() as conn:
         c = conn.cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS sessions (
             token TEXT PRIMARY KEY,
@@ -106,7 +120,7 @@ def logout():
     
     token = data['token']
     
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         c.execute('DELETE FROM sessions WHERE token = ?', (token,))
         conn.commit()
@@ -123,7 +137,7 @@ def verify_token():
     
     token = data['token']
     
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         session_data = c.execute('''
             SELECT s.user_id, u.username, u.role 
@@ -156,7 +170,7 @@ def get_users():
         return jsonify({'error': 'Token is required'}), 401
     
     # Verify token and check if user is admin
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         session_data = c.execute('''
             SELECT s.user_id, u.username, u.role 
@@ -174,7 +188,7 @@ def get_users():
         return jsonify({'error': 'Admin access required'}), 403
     
     # Get all users
-    with sqlite3.connect(USERS_DB_PATH) as conn:
+    with users_db.connect() as conn:
         c = conn.cursor()
         users = c.execute('SELECT id, username, role, created_at FROM users').fetchall()
     